@@ -30,6 +30,7 @@ class PyTest(TestCommand):
 def main():
     base_dir = dirname(__file__)
     install_requires = [
+        'cachetools',
         'splitio_client',
         'sqlalchemy',
     ]
@@ -41,6 +42,7 @@ def main():
         'pytest-mock>=3.5.1',
     ]
     extra_requires = {}
+    extra_requires['orjson'] = ['orjson']
     extra_requires['test'] = test_requires
     setup(
         name='split_client_side',
@@ -0,0 +1,131 @@
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from splitio.api.client import HttpClient, HttpClientException, HttpResponse
+
+
+class PooledHttpClient(HttpClient):
+    """
+    HttpClient that issues every request through one shared, keep-alive `requests.Session`.
+
+    Connections to the sdk, events and auth servers are pooled and reused across calls,
+    instead of paying for a new TCP + TLS handshake on every sync cycle.
+    """
+
+    def __init__(self, timeout=None, sdk_url=None, events_url=None, auth_url=None, *,  # pylint:disable=too-many-arguments
+                 pool_connections=4, pool_maxsize=16, max_retries=2):
+        """
+        Class constructor.
+
+        :param timeout: How many milliseconds to wait until the server responds.
+        :type timeout: `int`
+        :param sdk_url: Optional alternative sdk URL.
+        :type sdk_url: `str`
+        :param events_url: Optional alternative events URL.
+        :type events_url: `str`
+        :param auth_url: Optional alternative auth URL.
+        :type auth_url: `str`
+        :param pool_connections: Number of connection pools to cache per base URL.
+        :type pool_connections: `int`
+        :param pool_maxsize: Maximum number of connections to keep open per pool.
+        :type pool_maxsize: `int`
+        :param max_retries: How many times to retry connection errors before giving up.
+        :type max_retries: `int`
+        """
+        super().__init__(timeout=timeout, sdk_url=sdk_url, events_url=events_url, auth_url=auth_url)
+        self._pool_connections = pool_connections
+        self._pool_maxsize = pool_maxsize
+        self._max_retries = max_retries
+        self._session = None
+        self._session_lock = threading.Lock()
+
+    def _get_session(self):
+        """
+        Return the shared session, creating it the first time it is needed.
+
+        :rtype: :class:`requests.Session`
+        """
+        if self._session is None:
+            with self._session_lock:
+                if self._session is None:
+                    session = requests.Session()
+                    session.headers['Connection'] = 'keep-alive'
+                    for url in set(self._urls.values()):
+                        session.mount(url, HTTPAdapter(
+                            pool_connections=self._pool_connections,
+                            pool_maxsize=self._pool_maxsize,
+                            max_retries=Retry(total=self._max_retries, backoff_factor=0.2),
+                        ))
+                    self._session = session
+        return self._session
+
+    def _request(self, method, server, path, apikey, extra_headers=None, **kwargs):  # pylint:disable=too-many-arguments
+        headers = self._build_basic_headers(apikey)
+        if extra_headers is not None:
+            headers.update(extra_headers)
+
+        try:
+            response = self._get_session().request(
+                method,
+                self._build_url(server, path),
+                headers=headers,
+                timeout=self._timeout,
+                **kwargs
+            )
+            return HttpResponse(response.status_code, response.text)
+        except Exception as exc:  # pylint: disable=broad-except
+            raise HttpClientException('requests library is throwing exceptions') from exc
+
+    def get(self, server, path, apikey, query=None, extra_headers=None):  # pylint:disable=too-many-arguments
+        """
+        Issue a GET request.
+
+        :param server: Whether the request is for SDK server, Events server or Auth server.
+        :type server: `str`
+        :param path: path to append to the host url.
+        :type path: `str`
+        :param apikey: api token.
+        :type apikey: `str`
+        :param query: Query string passed as dictionary.
+        :type query: `dict`
+        :param extra_headers: key/value pairs of possible extra headers.
+        :type extra_headers: `dict`
+
+        :return: Tuple of status_code & response text
+        :rtype: HttpResponse
+        """
+        return self._request('GET', server, path, apikey, extra_headers=extra_headers, params=query)
+
+    def post(self, server, path, apikey, body, query=None, extra_headers=None):  # pylint:disable=too-many-arguments,too-many-positional-arguments
+        """
+        Issue a POST request.
+
+        :param server: Whether the request is for SDK server or Events server.
+        :type server: `str`
+        :param path: path to append to the host url.
+        :type path: `str`
+        :param apikey: api token.
+        :type apikey: `str`
+        :param body: body sent in the request.
+        :type body: `str`
+        :param query: Query string passed as dictionary.
+        :type query: `dict`
+        :param extra_headers: key/value pairs of possible extra headers.
+        :type extra_headers: `dict`
+
+        :return: Tuple of status_code & response text
+        :rtype: HttpResponse
+        """
+        return self._request('POST', server, path, apikey, extra_headers=extra_headers, json=body, params=query)
+
+    def close(self):
+        """
+        Close all pooled connections.
+        """
+        with self._session_lock:
+            if self._session is not None:
+                self._session.close()
+                self._session = None
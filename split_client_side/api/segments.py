@@ -1,17 +1,21 @@
-import json
 import logging
+import threading
+from urllib.parse import quote
 
+from cachetools import TTLCache
 from splitio.api import APIException
 from splitio.api.client import HttpClientException
 from splitio.api.segments import SegmentsAPI
 
+from ..serialization import loads as json_loads
+
 
 _LOGGER = logging.getLogger(__name__)
 
 
 class MySegmentsAPI(SegmentsAPI):
 
-    def __init__(self, http_client, apikey, sdk_metadata, traffic_key):
+    def __init__(self, http_client, apikey, sdk_metadata, traffic_key, *, cache_ttl=3, cache_size=16):  # pylint:disable=too-many-arguments
         """
         Class constructor.
 
@@ -23,31 +27,59 @@ class MySegmentsAPI(SegmentsAPI):
         :type sdk_metadata: splitio.client.util.SdkMetadata
         :param traffic_key: Traffic key to get segments for
         :type traffic_key: `str`
+        :param cache_ttl: How many seconds a fetched segment list is reused before hitting the backend again.
+        :type cache_ttl: `float`
+        :param cache_size: Maximum number of traffic keys to keep cached segment lists for.
+        :type cache_size: `int`
 
         """
         super().__init__(http_client, apikey, sdk_metadata)
         self._traffic_key = traffic_key
+        self._path = self._build_path(traffic_key)
+        self._cache = TTLCache(maxsize=cache_size, ttl=cache_ttl)
+        self._cache_lock = threading.Lock()
+
+    @staticmethod
+    def _build_path(traffic_key):
+        return '/mySegments/' + quote(traffic_key, safe='')
+
+    def cache_clear(self):
+        """
+        Drop all cached segment lists, so that the next fetch goes to the backend.
+        """
+        with self._cache_lock:
+            self._cache.clear()
 
     def fetch_segments(self, traffic_key):
         """
         Fetch my segments from backend.
 
+        Results are cached per traffic key for a short period of time.
+
         :param traffic_key: Traffic key to fetch segments for.
         :type traffic_key: str
 
         :return: List of segment names the traffic key belongs to
         :rtype: list
         """
+        with self._cache_lock:
+            try:
+                return self._cache[traffic_key]
+            except KeyError:
+                pass
         try:
             response = self._client.get(
                 'sdk',
-                '/mySegments/{traffic_key}'.format(traffic_key=traffic_key),
+                self._path if traffic_key == self._traffic_key else self._build_path(traffic_key),
                 self._apikey,
                 extra_headers=self._metadata,
             )
 
             if 200 <= response.status_code < 300:
-                return [s['name'] for s in json.loads(response.body)['mySegments']]
+                segment_names = [s['name'] for s in json_loads(response.body)['mySegments']]
+                with self._cache_lock:
+                    self._cache[traffic_key] = segment_names
+                return segment_names
             raise APIException(response.body, response.status_code)
         except HttpClientException as exc:
             _LOGGER.error(
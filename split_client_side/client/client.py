@@ -6,6 +6,11 @@ class ClientSideClient(Client):
         traffic_key = kwargs.pop('traffic_key')
         super().__init__(*args, **kwargs)
         self._traffic_key = traffic_key
+        # Resolve the parent implementations once, rather than through super() on every evaluation.
+        self._get_treatment = super().get_treatment
+        self._get_treatment_with_config = super().get_treatment_with_config
+        self._get_treatments = super().get_treatments
+        self._get_treatments_with_config = super().get_treatments_with_config
 
     def get_treatment_with_config(self, feature, attributes=None):
         """
@@ -22,7 +27,7 @@ class ClientSideClient(Client):
         :rtype: tuple(str, str)
         """
         # pylint:disable=arguments-differ
-        return super().get_treatment_with_config(self._traffic_key, feature, attributes)
+        return self._get_treatment_with_config(self._traffic_key, feature, attributes)
 
     def get_treatment(self, feature, attributes=None):
         """
@@ -39,7 +44,7 @@ class ClientSideClient(Client):
         :rtype: str
         """
         # pylint:disable=arguments-differ
-        return super().get_treatment(self._traffic_key, feature, attributes)
+        return self._get_treatment(self._traffic_key, feature, attributes)
 
     def get_treatments_with_config(self, features, attributes=None):
         """
@@ -56,7 +61,7 @@ class ClientSideClient(Client):
         :rtype: dict
         """
         # pylint:disable=arguments-differ
-        return super().get_treatments_with_config(self._traffic_key, features, attributes)
+        return self._get_treatments_with_config(self._traffic_key, features, attributes)
 
     def get_treatments(self, features, attributes=None):
         """
@@ -73,4 +78,4 @@ class ClientSideClient(Client):
         :rtype: dict
         """
         # pylint:disable=arguments-differ
-        return super().get_treatments(self._traffic_key, features, attributes)
+        return self._get_treatments(self._traffic_key, features, attributes)
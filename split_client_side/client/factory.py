@@ -6,7 +6,6 @@ from splitio.client import util
 from splitio.engine.impressions import Manager as ImpressionsManager
 
 # APIs
-from splitio.api.client import HttpClient
 from splitio.api.splits import SplitsAPI
 from splitio.api.impressions import ImpressionsAPI
 from splitio.api.events import EventsAPI
@@ -31,6 +30,7 @@ from splitio.sync.telemetry import TelemetrySynchronizer
 # Recorder
 from splitio.recorder.recorder import StandardRecorder
 
+from ..api.client import PooledHttpClient
 from ..api.segments import MySegmentsAPI
 from .client import ClientSideClient
 from ..storage.adapters import sql
@@ -42,17 +42,52 @@ from ..sync.segment import MySegmentsSynchronizer
 class ClientSideFactory(SplitFactory):
     def __init__(self, *args, **kwargs):
         traffic_key = kwargs.pop('traffic_key')
+        http_client = kwargs.pop('http_client', None)
         super().__init__(*args, **kwargs)
         self._traffic_key = traffic_key
+        self._http_client = http_client
+        self._client = None
+        self._client_lock = threading.Lock()
 
     def client(self):
         """
-        Return a new client.
+        Return the client bound to this factory's traffic key.
 
         This client is only a set of references to structures hold by the factory.
-        Creating one a fast operation and safe to be used anywhere.
+        It is created on first use and shared afterwards, so it is safe to call this anywhere.
         """
-        return ClientSideClient(self, self._recorder, self._labels_enabled, traffic_key=self._traffic_key)
+        if self._client is None:
+            with self._client_lock:
+                if self._client is None:
+                    self._client = ClientSideClient(self, self._recorder, self._labels_enabled, traffic_key=self._traffic_key)
+        return self._client
+
+    def destroy(self, destroyed_event=None):
+        """
+        Destroy the factory and render clients unusable, then close the pooled HTTP connections.
+
+        When waiting for the tasks to stop, connections are closed once they have, right before
+        the destroyed event is set.
+
+        :param destroyed_event: Event to signal when destroy process has finished.
+        :type destroyed_event: threading.Event
+        """
+        if self._http_client is None or self.destroyed or destroyed_event is None:
+            super().destroy(destroyed_event)
+            if self._http_client is not None:
+                self._http_client.close()
+            return
+
+        tasks_stopped = threading.Event()
+        super().destroy(tasks_stopped)
+
+        def _close_when_stopped():
+            tasks_stopped.wait()
+            self._http_client.close()
+            destroyed_event.set()
+
+        close_thread = threading.Thread(target=_close_when_stopped, name='HttpClientCloser', daemon=True)
+        close_thread.start()
 
 
 def build_factory(api_key, cfg, traffic_key, sdk_url=None, events_url=None,  # pylint:disable=too-many-arguments,too-many-locals
@@ -61,7 +96,7 @@ def build_factory(api_key, cfg, traffic_key, sdk_url=None, events_url=None,  # p
     if not input_validator.validate_factory_instantiation(api_key):
         return None
 
-    http_client = HttpClient(
+    http_client = PooledHttpClient(
         sdk_url=sdk_url,
         events_url=events_url,
         auth_url=auth_api_base_url,
@@ -72,7 +107,8 @@ def build_factory(api_key, cfg, traffic_key, sdk_url=None, events_url=None,  # p
     apis = {
         'auth': AuthAPI(http_client, api_key, sdk_metadata),
         'splits': SplitsAPI(http_client, api_key, sdk_metadata),
-        'segments': MySegmentsAPI(http_client, api_key, sdk_metadata, traffic_key),
+        'segments': MySegmentsAPI(http_client, api_key, sdk_metadata, traffic_key,
+                                  cache_ttl=cfg.get('segmentsCacheTTL', 3)),
         'impressions': ImpressionsAPI(http_client, api_key, sdk_metadata, cfg['impressionsMode']),
         'events': EventsAPI(http_client, api_key, sdk_metadata),
         'telemetry': TelemetryAPI(http_client, api_key, sdk_metadata)
@@ -81,11 +117,11 @@ def build_factory(api_key, cfg, traffic_key, sdk_url=None, events_url=None,  # p
     db_client = sql.build(cfg)
 
     storages = {
-        'splits': SqlSplitStorage(db_client),
+        'splits': SqlSplitStorage(db_client, cfg.get('splitCacheSize', 10000), cfg.get('splitCacheTTL', 1)),
         'segments': SqlMySegmentsStorage(db_client),
         'impressions': SqlImpressionStorage(db_client, cfg['impressionsQueueSize']),
         'events': SqlEventStorage(db_client, cfg['eventsQueueSize']),
-        'telemetry': SqlTelemetryStorage(db_client)
+        'telemetry': SqlTelemetryStorage(db_client, cfg.get('telemetryFlushThreshold', 1000))
     }
 
     imp_manager = ImpressionsManager(
@@ -145,4 +181,4 @@ def build_factory(api_key, cfg, traffic_key, sdk_url=None, events_url=None,  # p
     initialization_thread.start()
 
     return ClientSideFactory(api_key, storages, cfg['labelsEnabled'],
-                             recorder, manager, sdk_ready_flag, traffic_key=traffic_key)
+                             recorder, manager, sdk_ready_flag, traffic_key=traffic_key, http_client=http_client)
@@ -0,0 +1,27 @@
+"""JSON helpers, backed by orjson when it is installed."""
+
+__all__ = ['dumps', 'loads', 'loads_many']
+
+try:
+    from orjson import dumps, loads
+except ImportError:
+    import json
+
+    loads = json.loads
+
+    def dumps(obj):
+        """Serialize an object into compact JSON bytes, like `orjson.dumps`."""
+        return json.dumps(obj, separators=(',', ':')).encode('utf-8')
+
+
+def loads_many(documents):
+    """
+    Deserialize several JSON documents with a single parser pass.
+
+    :param documents: Serialized JSON documents, as bytes or str.
+    :type documents: iterable
+
+    :return: The deserialized documents, in order.
+    :rtype: list
+    """
+    return loads(b'[' + b','.join(doc.encode('utf-8') if isinstance(doc, str) else doc for doc in documents) + b']')
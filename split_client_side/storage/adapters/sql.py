@@ -1,40 +1,110 @@
-import datetime
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
 from functools import wraps
+import logging
+import struct
 import threading
 
 import sqlalchemy
+from sqlalchemy.dialects import mysql, postgresql, sqlite
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, relationship
-from sqlalchemy.pool import StaticPool
+from sqlalchemy.orm import relationship, sessionmaker
+from sqlalchemy.pool import QueuePool, StaticPool
 
+from splitio.models import splits
 from splitio.models.impressions import Label
 
+from ... import serialization
 
-db = threading.local()
-_db_session_lock = threading.Lock()
+
+_LOGGER = logging.getLogger(__name__)
 DeclarativeBase = declarative_base()
+# Bumped on every change to the tables below. Databases created before the schema was versioned are migrated,
+# databases created for another version are rebuilt.
+SCHEMA_VERSION = 1
+_SCHEMA_VERSION_NAME = 'schema_version'
+# Dialects supporting INSERT ... ON CONFLICT DO UPDATE
+_CONFLICT_INSERTS = {
+    'postgresql': postgresql.insert,
+    'sqlite': sqlite.insert,
+}
 
 
 def db_session(method):
     """
-    Decorator for a method that needs exclusive access to the database.
-    If a DB session exists for this thread already, the method will be called directly.
+    Decorator for a method that needs a DB session.
+    If a DB session exists in the current context already, the method will use it.
     If not, a DB session will be created. The session will be closed after the method returns.
     """
     @wraps(method)
     def db_session_method(self, *args, **kwargs):
-        if hasattr(db, 'session'):
+        with self.session():
             return method(self, *args, **kwargs)
-        with _db_session_lock:
-            db.session = self._db_session_maker()  # pylint:disable=protected-access
-            try:
-                return method(self, *args, **kwargs)
-            finally:
-                db.session.close()
-                del db.session
     return db_session_method
 
 
+def row_locking(method):
+    """
+    Decorator for a DbClient method that reads records and writes them back in the same transaction.
+    SQLite ignores SELECT ... FOR UPDATE, so on SQLite those methods are serialized within the process instead.
+    """
+    @wraps(method)
+    def row_locking_method(self, *args, **kwargs):
+        with self._row_lock:  # pylint:disable=protected-access
+            return method(self, *args, **kwargs)
+    return row_locking_method
+
+
+# Favor write throughput for the impression/event queues; WAL doesn't apply to in-memory databases.
+_SQLITE_FILE_PRAGMAS = (
+    'PRAGMA journal_mode=WAL',
+    'PRAGMA synchronous=NORMAL',
+    'PRAGMA temp_store=MEMORY',
+    'PRAGMA mmap_size=134217728',
+    'PRAGMA cache_size=-65536',
+)
+
+
+def _set_sqlite_file_pragmas(dbapi_connection, connection_record):  # pylint:disable=unused-argument
+    cursor = dbapi_connection.cursor()
+    try:
+        for pragma in _SQLITE_FILE_PRAGMAS:
+            cursor.execute(pragma)
+    finally:
+        cursor.close()
+
+
+_ORDER_DIRECTIONS = {
+    'asc': sqlalchemy.asc,
+    'desc': sqlalchemy.desc,
+}
+
+
+def _order_direction(direction):
+    try:
+        return _ORDER_DIRECTIONS[direction]
+    except KeyError:
+        raise ValueError(f'Invalid order direction {direction!r}, expected one of {sorted(_ORDER_DIRECTIONS)}') from None
+
+
+def _supports_delete_returning(dialect):
+    # SQLAlchemy 2.0 exposes delete_returning; 1.4 only supports RETURNING on dialects with full_returning.
+    if hasattr(dialect, 'delete_returning'):
+        return dialect.delete_returning
+    return getattr(dialect, 'full_returning', False)
+
+
+def _is_new_flat_record(record):
+    """
+    Whether a record can be bulk inserted: it has no primary key yet, and no relationships to cascade.
+    """
+    mapper = sqlalchemy.inspect(record).mapper
+    if mapper.relationships:
+        return False
+    return all(value is None for value in mapper.primary_key_from_instance(record))
+
+
 class DbClient:
     """
     Client for interacting with the Split SQLite database.
@@ -44,16 +114,137 @@ class DbClient:
 
     def __init__(self, config=None):
         super().__init__()
-        # default to config suitable for in-memory SQLite usage
-        default_config = {
-            'sql.url': 'sqlite://',
-            'sql.connect_args': {'check_same_thread': False},
-            'sql.poolclass': StaticPool,
-        }
-        default_config.update(config or {})
+        config = dict(config or {})
+        url = sqlalchemy.engine.make_url(config.get('sql.url', 'sqlite://'))
+        is_sqlite = url.get_backend_name() == 'sqlite'
+        in_memory = is_sqlite and url.database in (None, '', ':memory:')
+        # default to in-memory SQLite
+        default_config = {'sql.url': url}
+        if is_sqlite:
+            default_config['sql.connect_args'] = {'check_same_thread': False}
+        if in_memory:
+            # Every new connection to an in-memory database would get an empty database of its own.
+            default_config['sql.poolclass'] = StaticPool
+        else:
+            # Hand back the most recently used connection first, so the spare ones go idle; check it's alive before use.
+            default_config.update({
+                'sql.poolclass': QueuePool,
+                'sql.pool_use_lifo': True,
+                'sql.pool_pre_ping': True,
+            })
+        default_config.update(config)
         self._db_engine = sqlalchemy.engine_from_config(configuration=default_config, prefix='sql.')
-        DeclarativeBase.metadata.create_all(self._db_engine)
-        self._db_session_maker = sessionmaker(bind=self._db_engine, autoflush=True)
+        if is_sqlite and not in_memory:
+            sqlalchemy.event.listen(self._db_engine, 'connect', _set_sqlite_file_pragmas)
+        self._create_schema()
+        self._db_session_maker = sessionmaker(bind=self._db_engine, autoflush=False, expire_on_commit=False)
+        self._current_session = ContextVar(f'split_db_session_{id(self)}', default=None)
+        self._in_transaction = ContextVar(f'split_db_transaction_{id(self)}', default=False)
+        # A StaticPool hands the same connection to every thread, so transactions must not interleave.
+        self._connection_lock = threading.RLock() if isinstance(self._db_engine.pool, StaticPool) else nullcontext()
+        self._row_lock = threading.RLock() if is_sqlite else nullcontext()
+
+    @contextmanager
+    def _schema_transaction(self):
+        """
+        Provide a connection whose statements, schema changes included, run in a single transaction.
+        pysqlite only begins transactions before DML statements, so on SQLite the transaction is begun explicitly;
+        IMMEDIATE keeps other processes from changing the schema at the same time.
+        :rtype:                 :class:`sqlalchemy.engine.Connection`
+        """
+        if self._db_engine.dialect.name != 'sqlite':
+            with self._db_engine.begin() as connection:
+                yield connection
+            return
+        with self._db_engine.connect() as connection:
+            connection = connection.execution_options(isolation_level='AUTOCOMMIT')
+            # Ended by the DBAPI commit or rollback issued when the block exits.
+            with connection.begin():
+                connection.exec_driver_sql('BEGIN IMMEDIATE')
+                yield connection
+
+    def _create_schema(self):
+        """
+        Create the tables. Tables created before the schema was versioned are migrated, keeping what they held;
+        tables created for another schema version are dropped and re-created first, losing it.
+        """
+        with self._schema_transaction() as connection:
+            tables = set(sqlalchemy.inspect(connection).get_table_names())
+            version = None
+            if MetadataModel.__tablename__ in tables:
+                version = connection.execute(
+                    sqlalchemy.select(MetadataModel.number).where(MetadataModel.name == _SCHEMA_VERSION_NAME)
+                ).scalar()
+            migrated = {}
+            if version is None:
+                migrated = _take_unversioned_records(connection, tables)
+            elif version != SCHEMA_VERSION:
+                _LOGGER.warning('Rebuilding a database created for schema version %s, its data is lost.', version)
+                DeclarativeBase.metadata.drop_all(connection)
+            DeclarativeBase.metadata.create_all(connection)
+            for table in DeclarativeBase.metadata.sorted_tables:
+                if migrated.get(table.name):
+                    connection.execute(table.insert(), migrated[table.name])
+            if version != SCHEMA_VERSION:
+                connection.execute(
+                    MetadataModel.__table__.insert().values(name=_SCHEMA_VERSION_NAME, number=SCHEMA_VERSION)
+                )
+
+    @contextmanager
+    def session(self):
+        """
+        Provide the DB session for the current thread or coroutine.
+        An enclosing session is reused if there is one. If not, a new session is created and closed on exit;
+        when the engine shares a single connection between threads, it has exclusive access to it meanwhile.
+        :rtype:                 :class:`sqlalchemy.orm.Session`
+        """
+        session = self._current_session.get()
+        if session is not None:
+            yield session
+            return
+        with self._connection_lock:
+            session = self._db_session_maker()
+            token = self._current_session.set(session)
+            try:
+                yield session
+            finally:
+                session.close()
+                self._current_session.reset(token)
+
+    @property
+    def _session(self):
+        """The DB session of the current context."""
+        return self._current_session.get()
+
+    @contextmanager
+    def transaction(self):
+        """
+        Run the DB calls made within the block in a single transaction, committed when the block exits
+        and rolled back if it raises. A transaction within another one is part of the enclosing one.
+        :rtype:                 :class:`sqlalchemy.orm.Session`
+        """
+        with self.session() as session:
+            if self._in_transaction.get():
+                yield session
+                return
+            token = self._in_transaction.set(True)
+            try:
+                yield session
+                session.commit()
+            except BaseException:
+                session.rollback()
+                raise
+            finally:
+                self._in_transaction.reset(token)
+
+    def _commit(self):
+        """
+        Commit the changes made so far, or just send them to the DB if they are part of an enclosing transaction.
+        """
+        if self._in_transaction.get():
+            self._session.flush()
+        else:
+            self._session.commit()
 
     @db_session
     def get_all(self, model, *filters, group_by=None, order_by=None, direction='asc'):
@@ -70,49 +261,163 @@ class DbClient:
         :param filters:         Optional iterable of sqlalchemy filters to apply to the search.
         :rtype:                 `list` of `DeclarativeBase`
         """
-        query = db.session.query(model).filter(*filters)
+        order = _order_direction(direction)
+        query = self._session.query(model).filter(*filters)
         if order_by is not None:
-            query = query.order_by(getattr(order_by, direction)())
+            query = query.order_by(order(order_by))
         if group_by is not None:
             query = query.group_by(group_by)
         return query.all()
 
+    @db_session
+    def get_all_columns(self, columns, *filters, outer_join=None, group_by=None):
+        """
+        Get some columns of all the records matching the filters, without loading whole records.
+        :param columns:         Columns to fetch.
+        :type columns:          `list` of :class:`sqlalchemy.Column`
+        :param filters:         Optional iterable of sqlalchemy filters to apply to the search.
+        :param outer_join:      Optional relationship to LEFT OUTER JOIN with.
+        :type outer_join:       :class:`sqlalchemy.orm.RelationshipProperty`
+        :param group_by:        Optional column to group by.
+        :type group_by:         :class:`sqlalchemy.Column`
+        :rtype:                 `list` of `tuple`
+        """
+        query = self._session.query(*columns)
+        if outer_join is not None:
+            query = query.outerjoin(outer_join)
+        query = query.filter(*filters)
+        if group_by is not None:
+            query = query.group_by(group_by)
+        return query.all()
+
+    @db_session
+    def get_column(self, column, *filters):
+        """
+        Get the values of one column of all the records matching the filters.
+        :param column:          Column to fetch.
+        :type column:           :class:`sqlalchemy.Column`
+        :param filters:         Optional iterable of sqlalchemy filters to apply to the search.
+        :rtype:                 `list`
+        """
+        return self._session.execute(sqlalchemy.select(column).where(*filters)).scalars().all()
+
     @db_session
     def get_count(self, model, *filters):
-        query = db.session.query(model).filter(*filters)
+        query = self._session.query(model).filter(*filters)
         return query.count()
 
     @db_session
-    def get_one_or_none(self, model, *filters):
-        query = db.session.query(model).filter(*filters)
+    def get_aggregates(self, *aggregates):
+        """
+        Compute several aggregate expressions in a single query.
+        :param aggregates:      Aggregate expressions, such as `sqlalchemy.func.count(...)`.
+        :rtype:                 `tuple`
+        """
+        return tuple(self._session.query(*aggregates).one())
+
+    @db_session
+    def get_one_or_none(self, model, *filters, options=()):
+        query = self._session.query(model).options(*options).filter(*filters)
         return query.one_or_none()
 
     @db_session
     def get_first(self, model, *filters):
-        query = db.session.query(model).filter(*filters)
+        query = self._session.query(model).filter(*filters)
         return query.first()
 
+    @db_session
+    def exists(self, model, *filters):
+        """
+        Whether any record matches the filters, without loading it.
+        :param model:           DB model class to search for.
+        :type model:            :class:`DeclarativeBase`
+        :param filters:         Optional iterable of sqlalchemy filters to apply to the search.
+        :rtype:                 `bool`
+        """
+        return self._session.query(self._session.query(model).filter(*filters).exists()).scalar()
+
     @db_session
     def merge_and_commit(self, *records):
         """
         Add or update a new record into the DB.
+        New records without relationships are inserted in bulk; everything else is merged.
         :param record:          Record to add or update.
         :type record:           :class:`DeclarativeBase`
         """
+        new_records = []
         for record in records:
-            db.session.merge(record)
-        db.session.commit()
+            if _is_new_flat_record(record):
+                new_records.append(record)
+            else:
+                self._session.merge(record)
+        if new_records:
+            self._session.bulk_save_objects(new_records)
+        self._commit()
+
+    @db_session
+    def bulk_insert(self, model, rows):
+        """
+        Insert many new records with a single executemany INSERT, without building ORM objects.
+        :param model:           DB model class to insert into.
+        :type model:            :class:`DeclarativeBase`
+        :param rows:            Column values of each record to insert.
+        :type rows:             `list` of `dict`
+        """
+        if rows:
+            self._session.execute(model.__table__.insert(), rows)
+        self._commit()
+
+    @db_session
+    def insert_ignore(self, model, rows):
+        """
+        Insert many new records, skipping the ones that conflict with an existing record.
+        :param model:           DB model class to insert into.
+        :type model:            :class:`DeclarativeBase`
+        :param rows:            Column values of each record to insert.
+        :type rows:             `list` of `dict`
+        """
+        if rows:
+            dialect = self._db_engine.dialect.name
+            if dialect in _CONFLICT_INSERTS:
+                self._session.execute(_CONFLICT_INSERTS[dialect](model).on_conflict_do_nothing(), rows)
+            elif dialect == 'mysql':
+                self._session.execute(model.__table__.insert().prefix_with('IGNORE'), rows)
+            else:
+                for row in rows:
+                    try:
+                        with self._session.begin_nested():
+                            self._session.execute(model.__table__.insert(), row)
+                    except sqlalchemy.exc.IntegrityError:
+                        pass
+        self._commit()
 
     @db_session
     def update_or_insert(self, model, filter_kwargs, update_kwargs):
-        existing_record = db.session.query(model).filter_by(**filter_kwargs).one_or_none()
+        primary_key_names = [column.key for column in sqlalchemy.inspect(model).primary_key]
+        if set(filter_kwargs) == set(primary_key_names):
+            existing_record = self._session.get(model, tuple(filter_kwargs[name] for name in primary_key_names))
+        else:
+            existing_record = self._session.query(model).filter_by(**filter_kwargs).one_or_none()
         if existing_record is None:
             filter_kwargs.update(update_kwargs)
-            db.session.add(model(**filter_kwargs))
+            self._session.add(model(**filter_kwargs))
         else:
             for key, value in update_kwargs.items():
                 setattr(existing_record, key, value)
-        db.session.commit()
+        self._commit()
+
+    @db_session
+    def update_all(self, model, values, *filters):
+        """
+        Update all records of a certain type in a single statement.
+        :param model:           DB model class to update.
+        :type model:            :class:`DeclarativeBase`
+        :param values:          Column values to set.
+        :type values:           `dict`
+        :param filters:         Optional iterable of sqlalchemy filters to apply to the update.
+        """
+        self._session.query(model).filter(*filters).update(values, synchronize_session=False)
+        self._commit()
 
     @db_session
     def delete_all(self, model, *filters):
@@ -121,35 +426,174 @@ class DbClient:
         :param model:           DB model class to search for.
         :type model:            :class:`DeclarativeBase`
         :param filters:         Optional iterable of sqlalchemy filters to apply to the search.
+        :return:                Number of deleted records.
+        :rtype:                 int
         """
-        db.session.query(model).filter(*filters).delete()
-        db.session.commit()
+        deleted = self._session.query(model).filter(*filters).delete()
+        self._commit()
+        return deleted
 
     @db_session
+    @row_locking
     def pop(self, model, limit=None, *filters, order_by=None, direction='asc'):  # pylint:disable=keyword-arg-before-vararg
-        query = db.session.query(model).filter(*filters)
+        order = _order_direction(direction)
+        primary_key = sqlalchemy.inspect(model).primary_key[0]
+        if _supports_delete_returning(self._db_engine.dialect):
+            return self._pop_returning(model, primary_key, limit, filters, order_by=order_by, direction=direction)
+        query = self._session.query(model).filter(*filters)
         if order_by is not None:
-            query = query.order_by(getattr(order_by, direction)())
+            query = query.order_by(order(order_by))
         if limit is not None:
             query = query.limit(limit)
         rows = query.all()
-        for row in rows:
-            db.session.delete(row)
-        db.session.commit()
+        if rows:
+            self._session.execute(
+                sqlalchemy.delete(model)
+                .where(primary_key.in_([getattr(row, primary_key.key) for row in rows]))
+                .execution_options(synchronize_session=False)
+            )
+        self._commit()
+        return rows
+
+    @db_session
+    @row_locking
+    def pop_front(self, model, count, take):
+        """
+        Pop the oldest items of a queue whose records each hold a batch of items, in a single transaction.
+        Records are consumed in insertion order; the ones left without items are deleted.
+        :param model:           DB model class of the batches.
+        :type model:            :class:`DeclarativeBase`
+        :param count:           Maximum number of items to pop.
+        :type count:            `int`
+        :param take:            Callable that receives a record and how many items are still wanted;
+                                it removes up to that many items from the record and returns them,
+                                along with whether the record was left empty.
+        :type take:             `callable`
+        :rtype:                 `list`
+        """
+        primary_key = sqlalchemy.inspect(model).primary_key[0]
+        # Every batch holds at least one item, so there is no need to look past the first count records.
+        records = self._session.query(model).order_by(primary_key).limit(count).with_for_update().all()
+        items = []
+        for record in records:
+            if len(items) >= count:
+                break
+            taken, exhausted = take(record, count - len(items))
+            items.extend(taken)
+            if exhausted:
+                self._session.delete(record)
+        self._commit()
+        return items
+
+    def _pop_returning(self, model, primary_key, limit, filters, *, order_by, direction):  # pylint:disable=too-many-arguments
+        """
+        Pop records with a single DELETE ... RETURNING statement.
+        """
+        selected = sqlalchemy.select(primary_key).filter(*filters)
+        if order_by is not None:
+            selected = selected.order_by(_order_direction(direction)(order_by))
+        if limit is not None:
+            selected = selected.limit(limit)
+        result = self._session.execute(
+            sqlalchemy.delete(model)
+            .where(primary_key.in_(selected))
+            .returning(*model.__table__.columns)
+            .execution_options(synchronize_session=False)
+        )
+        rows = [model(**row._mapping) for row in result]  # pylint:disable=protected-access
+        self._commit()
+        # RETURNING doesn't guarantee any order.
+        sort_columns = [primary_key.key] if order_by is None else [order_by.key, primary_key.key]
+        rows.sort(key=lambda row: tuple(getattr(row, key) for key in sort_columns), reverse=direction == 'desc')
         return rows
 
     @db_session
-    def increment_or_create(self, model, column, *filters, **create_kwargs):
-        record = db.session.query(model).filter(*filters).one_or_none()
+    def increment_or_create(self, model, column, *filters, amount=1, **create_kwargs):
+        """
+        Atomically increment a column, creating the record if it doesn't exist.
+        :param model:           DB model class to search for.
+        :type model:            :class:`DeclarativeBase`
+        :param column:          Integer column to increment.
+        :type column:           :class:`sqlalchemy.Column`
+        :param filters:         Optional iterable of sqlalchemy filters that identify the record.
+        :param amount:          How much to increment the column by.
+        :type amount:           `int`
+        :param create_kwargs:   Unique attributes used to create the record when it doesn't exist.
+        """
+        values = dict(create_kwargs, **{column.name: amount})
+        statement = self._upsert_statement(model, list(create_kwargs), values, {column.name: column + amount})
+        if statement is None:
+            self._increment_or_create_generic(model, column, amount, *filters, **values)
+            return
+        self._session.execute(statement)
+        self._commit()
+
+    @db_session
+    def upsert(self, model, conflict_columns, values):
+        """
+        Insert a record, or update the existing record that conflicts with it, in a single statement.
+        :param model:           DB model class to insert into.
+        :type model:            :class:`DeclarativeBase`
+        :param conflict_columns: Names of the unique columns that identify the record.
+        :type conflict_columns: `list` of `str`
+        :param values:          Column values of the record.
+        :type values:           `dict`
+        """
+        update_values = {name: value for name, value in values.items() if name not in conflict_columns}
+        statement = self._upsert_statement(model, conflict_columns, values, update_values)
+        if statement is None:
+            self.update_or_insert(model, {name: values[name] for name in conflict_columns}, update_values)
+            return
+        self._session.execute(statement)
+        self._commit()
+
+    def _upsert_statement(self, model, conflict_columns, values, update_values):
+        """
+        Build a dialect specific INSERT statement that applies update_values on conflict,
+        or return None if the dialect doesn't support one.
+        """
+        dialect = self._db_engine.dialect.name
+        if dialect in _CONFLICT_INSERTS:
+            return _CONFLICT_INSERTS[dialect](model).values(**values).on_conflict_do_update(
+                index_elements=conflict_columns,
+                set_=update_values,
+            )
+        if dialect == 'mysql':
+            return mysql.insert(model).values(**values).on_duplicate_key_update(update_values)
+        return None
+
+    def _increment_or_create_generic(self, model, column, amount, *filters, **values):
+        record = self._session.query(model).filter(*filters).one_or_none()
         if record is None:
-            record = model(**create_kwargs)
             try:
-                db.session.add(record)
-                db.session.commit()
-            except Exception:  # pylint:disable=broad-except
-                record = db.session.query(model).filter(*filters).one()
-        setattr(record, column.name, column + 1)
-        db.session.commit()
+                with self._session.begin_nested():
+                    self._session.add(model(**values))
+                self._commit()
+                return
+            except sqlalchemy.exc.IntegrityError:
+                # Somebody else created the record in the meantime.
+                record = self._session.query(model).filter(*filters).one()
+        setattr(record, column.name, column + amount)
+        self._commit()
+
+    @db_session
+    @row_locking
+    def modify_or_create(self, model, modify, *filters, **create_kwargs):
+        """
+        Apply an in-place modification to a record, creating it first if it doesn't exist.
+        :param model:           DB model class to search for.
+        :type model:            :class:`DeclarativeBase`
+        :param modify:          Callable that receives the record and modifies it.
+        :type modify:           `callable`
+        :param filters:         Optional iterable of sqlalchemy filters that identify the record.
+        :param create_kwargs:   Attributes used to create the record when it doesn't exist.
+        """
+        record = self._session.query(model).filter(*filters).with_for_update().one_or_none()
+        if record is None:
+            record = model(**create_kwargs)
+            self._session.add(record)
+        modify(record)
+        self._commit()
 
 
 def build(config):
@@ -158,11 +602,15 @@ def build(config):
 
 class SplitModel(DeclarativeBase):
     __tablename__ = 'split_splits'
+    # Splits are looked up by name; on SQLite keep the rows in the primary key B-tree itself.
+    __table_args__ = {'sqlite_with_rowid': False}
 
-    id = sqlalchemy.Column(sqlalchemy.Integer, primary_key=True)  # pylint:disable=invalid-name
-    name = sqlalchemy.Column(sqlalchemy.String(120))
+    name = sqlalchemy.Column(sqlalchemy.String(120), primary_key=True)
     traffic_type_name = sqlalchemy.Column(sqlalchemy.String(120), index=True)
-    json_data = sqlalchemy.Column(sqlalchemy.Text)
+    change_number = sqlalchemy.Column(sqlalchemy.BigInteger)
+    # Comma separated names of the segments the split references.
+    segment_names = sqlalchemy.Column(sqlalchemy.Text)
+    json_data = sqlalchemy.Column(sqlalchemy.LargeBinary)
 
 
 class MetadataModel(DeclarativeBase):
@@ -176,28 +624,37 @@ class SegmentModel(DeclarativeBase):
     __tablename__ = 'split_segments'
 
     id = sqlalchemy.Column(sqlalchemy.Integer, primary_key=True)  # pylint:disable=invalid-name
-    name = sqlalchemy.Column(sqlalchemy.String(120))
+    name = sqlalchemy.Column(sqlalchemy.String(120), index=True)
     change_number = sqlalchemy.Column(sqlalchemy.Integer)
-    keys = relationship('SegmentKeyModel', lazy='joined')
+    keys = relationship('SegmentKeyModel', lazy='select')
 
 
 class SegmentKeyModel(DeclarativeBase):
     __tablename__ = 'split_segment_keys'
+    # Keys are looked up by segment and name; on SQLite keep the rows in the primary key B-tree itself.
+    __table_args__ = {'sqlite_with_rowid': False}
 
-    id = sqlalchemy.Column(sqlalchemy.Integer, primary_key=True)  # pylint:disable=invalid-name
-    name = sqlalchemy.Column(sqlalchemy.Text)
-    model_id = sqlalchemy.Column(sqlalchemy.Integer, sqlalchemy.ForeignKey('split_segments.id'))
-    model = relationship('SegmentModel', back_populates='keys', lazy='joined')
+    model_id = sqlalchemy.Column(sqlalchemy.Integer, sqlalchemy.ForeignKey('split_segments.id'), primary_key=True)
+    # Bounded, since MySQL can't use a TEXT column in a key.
+    name = sqlalchemy.Column(sqlalchemy.String(255), primary_key=True)
+    model = relationship('SegmentModel', back_populates='keys', lazy='select')
 
 
 class MySegmentModel(DeclarativeBase):
     __tablename__ = 'split_my_segments'
+    __table_args__ = (
+        sqlalchemy.Index('ix_mysegment_tk_name', 'traffic_key', 'segment_name', unique=True),
+    )
 
     id = sqlalchemy.Column(sqlalchemy.Integer, primary_key=True)  # pylint:disable=invalid-name
     traffic_key = sqlalchemy.Column(sqlalchemy.String(120))
     segment_name = sqlalchemy.Column(sqlalchemy.String(120))
 
 
+# Impression and event records hold whole batches; MySQL caps a plain BLOB at 64 KiB, this picks MEDIUMBLOB.
+_BATCH_BYTES = 2 ** 24 - 1
+
+
 class ImpressionModel(DeclarativeBase):
     __tablename__ = 'split_impressions'
 
@@ -210,80 +667,52 @@ class ImpressionModel(DeclarativeBase):
         Label.NOT_READY,
         Label.SPLIT_NOT_FOUND,
     ))
-    created_at = sqlalchemy.Column(sqlalchemy.DateTime, default=datetime.datetime.now)
-    json_data = sqlalchemy.Column(sqlalchemy.Text)
+    # JSON array of the impressions stored together.
+    json_data = sqlalchemy.Column(sqlalchemy.LargeBinary(_BATCH_BYTES))
+    item_count = sqlalchemy.Column(sqlalchemy.Integer)
 
 
 class EventModel(DeclarativeBase):
     __tablename__ = 'split_events'
 
     id = sqlalchemy.Column(sqlalchemy.Integer, primary_key=True)  # pylint:disable=invalid-name
-    created_at = sqlalchemy.Column(sqlalchemy.DateTime, default=datetime.datetime.now)
-    json_data = sqlalchemy.Column(sqlalchemy.Text)
+    # JSON array of [size, event] pairs of the events stored together.
+    json_data = sqlalchemy.Column(sqlalchemy.LargeBinary(_BATCH_BYTES))
+    item_count = sqlalchemy.Column(sqlalchemy.Integer)
+    # Total size of the events.
     size = sqlalchemy.Column(sqlalchemy.Integer)
 
 
+LATENCY_BUCKET_COUNT = 22
+_LATENCY_BUCKETS = struct.Struct(f'<{LATENCY_BUCKET_COUNT}I')
+_EMPTY_LATENCY_BUCKETS = bytes(_LATENCY_BUCKETS.size)
+
+
 class LatencyModel(DeclarativeBase):
     __tablename__ = 'split_latencies'
 
     id = sqlalchemy.Column(sqlalchemy.Integer, primary_key=True)  # pylint:disable=invalid-name
     name = sqlalchemy.Column(sqlalchemy.Text)
-    bucket_0 = sqlalchemy.Column(sqlalchemy.Integer, default=0)
-    bucket_1 = sqlalchemy.Column(sqlalchemy.Integer, default=0)
-    bucket_2 = sqlalchemy.Column(sqlalchemy.Integer, default=0)
-    bucket_3 = sqlalchemy.Column(sqlalchemy.Integer, default=0)
-    bucket_4 = sqlalchemy.Column(sqlalchemy.Integer, default=0)
-    bucket_5 = sqlalchemy.Column(sqlalchemy.Integer, default=0)
-    bucket_6 = sqlalchemy.Column(sqlalchemy.Integer, default=0)
-    bucket_7 = sqlalchemy.Column(sqlalchemy.Integer, default=0)
-    bucket_8 = sqlalchemy.Column(sqlalchemy.Integer, default=0)
-    bucket_9 = sqlalchemy.Column(sqlalchemy.Integer, default=0)
-    bucket_10 = sqlalchemy.Column(sqlalchemy.Integer, default=0)
-    bucket_11 = sqlalchemy.Column(sqlalchemy.Integer, default=0)
-    bucket_12 = sqlalchemy.Column(sqlalchemy.Integer, default=0)
-    bucket_13 = sqlalchemy.Column(sqlalchemy.Integer, default=0)
-    bucket_14 = sqlalchemy.Column(sqlalchemy.Integer, default=0)
-    bucket_15 = sqlalchemy.Column(sqlalchemy.Integer, default=0)
-    bucket_16 = sqlalchemy.Column(sqlalchemy.Integer, default=0)
-    bucket_17 = sqlalchemy.Column(sqlalchemy.Integer, default=0)
-    bucket_18 = sqlalchemy.Column(sqlalchemy.Integer, default=0)
-    bucket_19 = sqlalchemy.Column(sqlalchemy.Integer, default=0)
-    bucket_20 = sqlalchemy.Column(sqlalchemy.Integer, default=0)
-    bucket_21 = sqlalchemy.Column(sqlalchemy.Integer, default=0)
+    buckets_blob = sqlalchemy.Column(sqlalchemy.LargeBinary(_LATENCY_BUCKETS.size), default=_EMPTY_LATENCY_BUCKETS)
 
     @property
     def buckets(self):
-        return [
-            self.bucket_0,
-            self.bucket_1,
-            self.bucket_2,
-            self.bucket_3,
-            self.bucket_4,
-            self.bucket_5,
-            self.bucket_6,
-            self.bucket_7,
-            self.bucket_8,
-            self.bucket_9,
-            self.bucket_10,
-            self.bucket_11,
-            self.bucket_12,
-            self.bucket_13,
-            self.bucket_14,
-            self.bucket_15,
-            self.bucket_16,
-            self.bucket_17,
-            self.bucket_18,
-            self.bucket_19,
-            self.bucket_20,
-            self.bucket_21,
-        ]
+        return list(_LATENCY_BUCKETS.unpack(self.buckets_blob or _EMPTY_LATENCY_BUCKETS))
+
+    def add(self, counts):
+        """
+        Add per-bucket counts to the latency histogram.
+        :param counts:          Count to add to each of the buckets.
+        :type counts:           `list` of `int`
+        """
+        self.buckets_blob = _LATENCY_BUCKETS.pack(*(total + count for total, count in zip(self.buckets, counts)))
 
 
 class CounterModel(DeclarativeBase):
     __tablename__ = 'split_counters'
 
     id = sqlalchemy.Column(sqlalchemy.Integer, primary_key=True)  # pylint:disable=invalid-name
-    name = sqlalchemy.Column(sqlalchemy.Text)
+    name = sqlalchemy.Column(sqlalchemy.String(120), unique=True)
     value = sqlalchemy.Column(sqlalchemy.Integer, default=0)
 
 
@@ -291,5 +720,112 @@ class GaugeModel(DeclarativeBase):
     __tablename__ = 'split_gauges'
 
     id = sqlalchemy.Column(sqlalchemy.Integer, primary_key=True)  # pylint:disable=invalid-name
-    name = sqlalchemy.Column(sqlalchemy.Text)
+    name = sqlalchemy.Column(sqlalchemy.String(120), unique=True)
     value = sqlalchemy.Column(sqlalchemy.Integer)
+
+
+# Migration of the tables created before the schema was versioned. Each table whose layout changed is read
+# with the columns it had then, and dropped; its records are converted to the current layout, to be inserted
+# once the current tables are created.
+
+def _migrate_splits(rows):
+    records = {}
+    for name, json_data in rows:
+        split = splits.from_raw(serialization.loads(json_data))
+        records[name] = {
+            'name': name,
+            'traffic_type_name': split.traffic_type_name,
+            'change_number': split.change_number,
+            'segment_names': ','.join(sorted(split.get_segment_names())),
+            'json_data': json_data.encode('utf-8'),
+        }
+    return list(records.values())
+
+
+def _migrate_segments(rows):
+    return [{'id': segment_id, 'name': name, 'change_number': change_number} for segment_id, name, change_number in rows]
+
+
+def _migrate_segment_keys(rows):
+    keys = {(model_id, name) for model_id, name in rows if model_id is not None and name is not None}
+    return [{'model_id': model_id, 'name': name} for model_id, name in keys]
+
+
+def _migrate_my_segments(rows):
+    memberships = dict.fromkeys(tuple(row) for row in rows)
+    return [{'traffic_key': traffic_key, 'segment_name': segment_name} for traffic_key, segment_name in memberships]
+
+
+def _migrate_impressions(rows):
+    # Each impression was a record of its own; it becomes a batch of one.
+    return [{'json_data': b'[' + json_data.encode('utf-8') + b']', 'item_count': 1} for (json_data,) in rows]
+
+
+def _migrate_events(rows):
+    return [
+        {'json_data': serialization.dumps([[size or 0, serialization.loads(json_data)]]), 'item_count': 1, 'size': size or 0}
+        for json_data, size in rows
+    ]
+
+
+def _migrate_latencies(rows):
+    latencies = {}
+    for name, *counts in rows:
+        totals = latencies.setdefault(name, [0] * LATENCY_BUCKET_COUNT)
+        for bucket, count in enumerate(counts):
+            totals[bucket] += count or 0
+    return [{'name': name, 'buckets_blob': _LATENCY_BUCKETS.pack(*totals)} for name, totals in latencies.items()]
+
+
+def _migrate_counters(rows):
+    counters = Counter()
+    for name, value in rows:
+        counters[name] += value or 0
+    return [{'name': name, 'value': value} for name, value in counters.items()]
+
+
+def _migrate_gauges(rows):
+    # Rows are read in insertion order, so the last value of each gauge wins.
+    return [{'name': name, 'value': value} for name, value in dict(rows).items()]
+
+
+_UNVERSIONED_TABLES = (
+    (SplitModel, ('name', 'json_data'), _migrate_splits),
+    (SegmentModel, ('id', 'name', 'change_number'), _migrate_segments),
+    (SegmentKeyModel, ('model_id', 'name'), _migrate_segment_keys),
+    (MySegmentModel, ('traffic_key', 'segment_name'), _migrate_my_segments),
+    (ImpressionModel, ('json_data',), _migrate_impressions),
+    (EventModel, ('json_data', 'size'), _migrate_events),
+    (LatencyModel, ('name',) + tuple(f'bucket_{bucket}' for bucket in range(LATENCY_BUCKET_COUNT)), _migrate_latencies),
+    (CounterModel, ('name', 'value'), _migrate_counters),
+    (GaugeModel, ('name', 'value'), _migrate_gauges),
+)
+
+
+def _take_unversioned_records(connection, tables):
+    """
+    Read and drop the tables created before the schema was versioned, for them to be re-created.
+    :param connection:      Connection of the schema transaction.
+    :type connection:       :class:`sqlalchemy.engine.Connection`
+    :param tables:          Names of the existing tables.
+    :type tables:           `set` of `str`
+    :return:                Records to insert into each re-created table, in the current layout.
+    :rtype:                 `dict`
+    """
+    records = {}
+    for model, columns, migrate in _UNVERSIONED_TABLES:
+        name = model.__tablename__
+        if name not in tables:
+            continue
+        rows = connection.execute(
+            sqlalchemy.select(*(sqlalchemy.column(column) for column in columns))
+            .select_from(sqlalchemy.table(name))
+            .order_by(sqlalchemy.column('id'))
+        ).fetchall()
+        records[name] = migrate(rows)
+    for model, _, _ in reversed(_UNVERSIONED_TABLES):
+        if model.__tablename__ in tables:
+            model.__table__.drop(connection)
+    if records:
+        _LOGGER.info('Migrated the tables created before schema version %d.', SCHEMA_VERSION)
+    return records
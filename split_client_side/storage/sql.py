@@ -1,29 +1,122 @@
-import json
-
+# pylint:disable=too-many-lines
+from array import array
+from collections import Counter, defaultdict, namedtuple
+import hashlib
+from itertools import starmap
+import logging
 import threading
+import time
 
+from cachetools import LRUCache, TTLCache
+from sqlalchemy import func
 from splitio.models import splits, segments
 from splitio.models.events import Event
 from splitio.models.impressions import Impression
 from splitio.storage import SplitStorage, ImpressionStorage, SegmentStorage, EventStorage, TelemetryStorage
+from .. import serialization
 from .adapters.sql import SplitModel, MetadataModel, SegmentKeyModel, SegmentModel, \
-    ImpressionModel, EventModel, CounterModel, GaugeModel, LatencyModel, MySegmentModel
+    ImpressionModel, EventModel, CounterModel, GaugeModel, LatencyModel, MySegmentModel, LATENCY_BUCKET_COUNT
+
+
+_LOGGER = logging.getLogger(__name__)
+_MISSING = object()
+# Long IN lists are split into chunks of this many values, to stay well below SQLite's limit on bound parameters.
+_PARAMETERS_PER_STATEMENT = 500
+
+
+def _chunks(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
 
 
 class SqlSplitStorage(SplitStorage):
     """Split storage interface implemention backed by a database."""
 
-    def __init__(self, db_client) -> None:
+    _LOCK_STRIPES = 16
+    # Columns needed to decode a stored split.
+    _RECORD_COLUMNS = (SplitModel.name, SplitModel.change_number, SplitModel.json_data)
+
+    def __init__(self, db_client, cache_size=10000, cache_ttl=1) -> None:
+        """
+        Class constructor.
+
+        :param db_client: DB client or compliant interface.
+        :type db_client: splitio.storage.sql.DbClient
+        :param cache_size: How many decoded splits to keep in memory.
+        :type cache_size: int
+        :param cache_ttl: How many seconds a looked up split is served from memory without querying the DB.
+        :type cache_ttl: float
+        """
         super().__init__()
         self._db_client = db_client
-        self._lock = threading.Lock()
+        # Striped by split name, so that changes to unrelated splits don't contend.
+        self._locks = tuple(threading.Lock() for _ in range(self._LOCK_STRIPES))
+        # split name -> (change number, decoded split)
+        self._cache = LRUCache(maxsize=cache_size)
+        # split name -> split, or None if it doesn't exist. Invalidated by this storage's own changes;
+        # the TTL bounds how long changes written by somebody else go unnoticed.
+        self._lookups = TTLCache(maxsize=cache_size, ttl=cache_ttl)
+        # Bumped on every invalidation, so that lookups racing with a change don't cache what they read.
+        self._generation = 0
+        self._cache_lock = threading.Lock()
+        # traffic type name -> whether any stored split uses it. Invalidated and expired like the lookups.
+        self._traffic_types = TTLCache(maxsize=cache_size, ttl=cache_ttl)
 
-    def _get_split_record(self, split_name):
-        return self._db_client.get_one_or_none(SplitModel, SplitModel.name == split_name)
+    def _get_split_records(self, *filters):
+        """
+        Load the columns needed to decode the matching splits, without building ORM objects.
+        """
+        return self._db_client.get_all_columns(self._RECORD_COLUMNS, *filters)
 
-    @staticmethod
-    def _get_split_from_record(split_record):
-        return splits.from_raw(json.loads(split_record.json_data))
+    def _get_split_record(self, split_name):
+        records = self._get_split_records(SplitModel.name == split_name)
+        return records[0] if records else None
+
+    def _get_split_from_record(self, split_record):
+        return self._get_splits_from_records([split_record])[0]
+
+    def _get_splits_from_records(self, split_records):
+        """
+        Decode split records, reusing cached splits and decoding the rest in a single pass.
+        """
+        result = []
+        misses = []
+        with self._cache_lock:
+            for record in split_records:
+                cached = self._cache.get(record.name)
+                if cached is not None and cached[0] == record.change_number:
+                    result.append(cached[1])
+                else:
+                    result.append(None)
+                    misses.append((len(result) - 1, record))
+        if misses:
+            raw_splits = serialization.loads_many(record.json_data for _, record in misses)
+            decoded = [(index, record, splits.from_raw(raw)) for (index, record), raw in zip(misses, raw_splits)]
+            with self._cache_lock:
+                for index, record, split in decoded:
+                    self._cache[record.name] = (record.change_number, split)
+                    result[index] = split
+        return result
+
+    def _lock_for(self, split_name):
+        return self._locks[hash(split_name) % self._LOCK_STRIPES]
+
+    def _invalidate(self, split_name):
+        with self._cache_lock:
+            self._cache.pop(split_name, None)
+            self._lookups.pop(split_name, None)
+            # A change can add a traffic type, or take the last split of the one the split had before.
+            # Dropping every answer is cheaper than reading the previous traffic type before each write.
+            self._traffic_types.clear()
+            self._generation += 1
+
+    def _remember(self, generation, found):
+        """
+        Keep looked up splits in memory, unless the storage changed since the lookup started.
+        """
+        with self._cache_lock:
+            if generation == self._generation:
+                self._lookups.update(found)
 
     def get(self, split_name):
         """
@@ -34,10 +127,15 @@ class SqlSplitStorage(SplitStorage):
 
         :rtype: str
         """
+        with self._cache_lock:
+            split = self._lookups.get(split_name, _MISSING)
+            generation = self._generation
+        if split is not _MISSING:
+            return split
         record = self._get_split_record(split_name)
-        if record is None:
-            return None
-        return self._get_split_from_record(record)
+        split = None if record is None else self._get_split_from_record(record)
+        self._remember(generation, {split_name: split})
+        return split
 
     def fetch_many(self, split_names):
         """
@@ -48,11 +146,22 @@ class SqlSplitStorage(SplitStorage):
 
         :rtype: dict
         """
-        records = self._db_client.get_all(SplitModel, SplitModel.name.in_(split_names), group_by=SplitModel.name)
-        split_dict = {name: None for name in split_names}
-        for record in records:
-            split_dict[record.name] = self._get_split_from_record(record)
-        return split_dict
+        with self._cache_lock:
+            found = {name: self._lookups.get(name, _MISSING) for name in split_names}
+            generation = self._generation
+        missing = dict.fromkeys(name for name, split in found.items() if split is _MISSING)
+        # Names are unique, so no grouping is needed; long lists are split to stay below the bound parameter limit.
+        records = [
+            record
+            for chunk in _chunks(list(missing), _PARAMETERS_PER_STATEMENT)
+            for record in self._get_split_records(SplitModel.name.in_(chunk))
+        ]
+        for record, split in zip(records, self._get_splits_from_records(records)):
+            missing[record.name] = split
+        if missing:
+            self._remember(generation, missing)
+        found.update(missing)
+        return found
 
     def put(self, split):
         """
@@ -61,20 +170,24 @@ class SqlSplitStorage(SplitStorage):
         :param split: Split object to store
         :type split_name: splitio.models.splits.Split
         """
-        models_to_merge = []
-        with self._lock:
-            existing_split_record = self._get_split_record(split.name)
-            if existing_split_record is None:
-                models_to_merge.append(SplitModel(
-                    name=split.name,
-                    traffic_type_name=split.traffic_type_name,
-                    json_data=json.dumps(split.to_json())
-                ))
-            else:
-                models_to_merge.append(existing_split_record)
-                existing_split_record.traffic_type_name = split.traffic_type_name
-                existing_split_record.json_data = json.dumps(split.to_json())
-            self._db_client.merge_and_commit(*models_to_merge)
+        with self._lock_for(split.name):
+            self._store(split)
+
+    def _store(self, split):
+        """
+        Store a split. Called with the split's lock held.
+
+        :param split: Split object to store
+        :type split_name: splitio.models.splits.Split
+        """
+        self._db_client.upsert(SplitModel, ['name'], dict(
+            name=split.name,
+            traffic_type_name=split.traffic_type_name,
+            change_number=split.change_number,
+            segment_names=','.join(sorted(split.get_segment_names())),
+            json_data=serialization.dumps(split.to_json()),
+        ))
+        self._invalidate(split.name)
 
     def remove(self, split_name):
         """
@@ -86,11 +199,10 @@ class SqlSplitStorage(SplitStorage):
         :return: True if the split was found and removed. False otherwise.
         :rtype: bool
         """
-        with self._lock:
-            existing_split = self.get(split_name)
-            if existing_split is None:
+        with self._lock_for(split_name):
+            if not self._db_client.delete_all(SplitModel, SplitModel.name == split_name):
                 return False
-            self._db_client.delete_all(SplitModel, SplitModel.name == split_name)
+            self._invalidate(split_name)
             return True
 
     def get_change_number(self):
@@ -109,7 +221,7 @@ class SqlSplitStorage(SplitStorage):
         :param new_change_number: New change number.
         :type new_change_number: int
         """
-        self._db_client.update_or_insert(MetadataModel, dict(name='change_number'), dict(number=new_change_number))
+        self._db_client.upsert(MetadataModel, ['name'], dict(name='change_number', number=new_change_number))
 
     def get_split_names(self):
         """
@@ -118,8 +230,8 @@ class SqlSplitStorage(SplitStorage):
         :return: List of split names.
         :rtype: list(str)
         """
-        records = self._db_client.get_all(SplitModel)
-        return list(set(record.name for record in records))
+        # Names are unique, so there is nothing to deduplicate.
+        return self._db_client.get_column(SplitModel.name)
 
     def get_all_splits(self):
         """
@@ -128,8 +240,7 @@ class SqlSplitStorage(SplitStorage):
         :return: List of all the splits.
         :rtype: list
         """
-        records = self._db_client.get_all(SplitModel)
-        return [splits.from_raw(json.loads(record.json_data)) for record in records]
+        return self._get_splits_from_records(self._get_split_records())
 
     def is_valid_traffic_type(self, traffic_type_name):
         """
@@ -141,8 +252,15 @@ class SqlSplitStorage(SplitStorage):
         :return: True if the traffic type is valid. False otherwise.
         :rtype: bool
         """
-        record = self._db_client.get_first(SplitModel, SplitModel.traffic_type_name == traffic_type_name)
-        return record is not None
+        with self._cache_lock:
+            valid = self._traffic_types.get(traffic_type_name)
+            generation = self._generation
+        if valid is None:
+            valid = self._db_client.exists(SplitModel, SplitModel.traffic_type_name == traffic_type_name)
+            with self._cache_lock:
+                if generation == self._generation:
+                    self._traffic_types[traffic_type_name] = valid
+        return valid
 
     def get_segment_names(self):
         """
@@ -151,7 +269,8 @@ class SqlSplitStorage(SplitStorage):
         :return: Set of all segment names.
         :rtype: set(string)
         """
-        return {name for spl in self.get_all_splits() for name in spl.get_segment_names()}
+        rows = self._db_client.get_all_columns([SplitModel.segment_names])
+        return {name for (segment_names,) in rows if segment_names for name in segment_names.split(',')}
 
     def kill_locally(self, split_name, default_treatment, change_number):
         """
@@ -164,27 +283,134 @@ class SqlSplitStorage(SplitStorage):
         :param change_number: change_number
         :type change_number: int
         """
-        with self._lock:
+        with self._lock_for(split_name):
             if self.get_change_number() > change_number:
                 return
-            split = self.get(split_name)
-            if not split:
+            record = self._get_split_record(split_name)
+            if record is None:
                 return
+            # Kill a private copy; cached splits are shared with ongoing evaluations.
+            split = splits.from_raw(serialization.loads(record.json_data))
             split.local_kill(default_treatment, change_number)
-            self.put(split)
+            self._store(split)
+
+
+class _BloomFilter:
+    """
+    Set membership filter with no false negatives, and a few percent false positives.
+
+    Keys are never removed; a removed key just keeps answering "maybe".
+    """
+
+    _HASH_COUNT = 3
+    _BITS_PER_KEY = 10
+    _MIN_BITS = 1024
+
+    def __init__(self, keys):
+        """
+        Build a filter sized for, and holding, the given keys.
+
+        :param keys: Keys to add.
+        :type keys: set
+        """
+        self._size = max(self._MIN_BITS, self._BITS_PER_KEY * len(keys))
+        self._bits = bytearray((self._size + 7) // 8)
+        self.update(keys)
+
+    def _positions(self, key):
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+        first, second = int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little')
+        return [(first + index * second) % self._size for index in range(self._HASH_COUNT)]
+
+    def update(self, keys):
+        """
+        Add keys to the filter.
+
+        :param keys: Keys to add.
+        :type keys: iterable
+        """
+        for key in keys:
+            for position in self._positions(key):
+                self._bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, key):
+        return all(self._bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+
+class _SegmentFilter(namedtuple('_SegmentFilter', ['keys', 'change_number', 'expires'])):
+    """Filter of the keys stored in a segment, valid while the segment keeps the change number, checked once expired."""
+
+    __slots__ = ()
 
 
 class SqlSegmentStorage(SegmentStorage):
     """DB based segment storage class."""
 
-    def __init__(self, db_client):
+    _LOCK_STRIPES = 16
+    # A plain join lets both lookups use their indexes, unlike the correlated subquery of SegmentKeyModel.model.has().
+    _KEY_SEGMENT_JOIN = SegmentKeyModel.model_id == SegmentModel.id
+
+    def __init__(self, db_client, cache_ttl=1):
         """
         Class constructor.
 
         :param db_client: DB client or compliant interface.
         :type db_client: splitio.storage.sql.DbClient
+        :param cache_ttl: How many seconds a segment filter rules keys out before checking the segment didn't change.
+        :type cache_ttl: float
         """
         self._db_client = db_client
+        self._cache_ttl = cache_ttl
+        # segment name -> filter of every key this instance stored in the segment, to rule keys out without a query.
+        # Segments stored by somebody else have no filter and are always looked up in the DB. Once a filter expires,
+        # it's kept only if the segment still has the change number it was built for, since another storage
+        # may have added keys meanwhile.
+        self._filters = {}
+        # Striped by segment name. Held while storing keys and replacing filters, so that keys added
+        # by an update can't miss a filter that is being rebuilt.
+        self._locks = tuple(threading.Lock() for _ in range(self._LOCK_STRIPES))
+
+    def _lock_for(self, segment_name):
+        return self._locks[hash(segment_name) % self._LOCK_STRIPES]
+
+    def _get_segment(self, segment_name):
+        rows = self._db_client.get_all_columns([SegmentModel.id, SegmentModel.change_number], SegmentModel.name == segment_name)
+        return rows[0] if rows else None
+
+    def _get_or_create_segment(self, segment_name, change_number):
+        """
+        :return: Id and stored change number of the segment.
+        :rtype: tuple
+        """
+        segment = self._get_segment(segment_name)
+        if segment is None:
+            self._db_client.merge_and_commit(SegmentModel(name=segment_name, change_number=change_number))
+            segment = self._get_segment(segment_name)
+        return segment
+
+    def _renew_filter(self, segment_name, stored_change_number, change_number):
+        """
+        Move the filter of a segment, if any, to the change number set by this storage. Called with the segment's lock held.
+        """
+        segment_filter = self._filters.get(segment_name)
+        if segment_filter is None:
+            return
+        if stored_change_number == segment_filter.change_number:
+            self._filters[segment_name] = segment_filter._replace(change_number=change_number)
+        else:
+            # Somebody else changed the segment since the filter was built.
+            del self._filters[segment_name]
+
+    def _insert_keys(self, segment_id, keys):
+        self._db_client.bulk_insert(SegmentKeyModel, [{'model_id': segment_id, 'name': key} for key in keys])
+
+    def _delete_keys(self, segment_id, keys):
+        for chunk in _chunks(list(keys), _PARAMETERS_PER_STATEMENT):
+            self._db_client.delete_all(
+                SegmentKeyModel,
+                SegmentKeyModel.model_id == segment_id,
+                SegmentKeyModel.name.in_(chunk),
+            )
 
     def get(self, segment_name):
         """
@@ -195,11 +421,15 @@ class SqlSegmentStorage(SegmentStorage):
 
         :rtype: str
         """
-        record = self._db_client.get_one_or_none(SegmentModel, SegmentModel.name == segment_name)
-        if record is not None:
-            keys = [key.name for key in record.keys]
-            return segments.Segment(segment_name, keys, record.change_number)
-        return None
+        rows = self._db_client.get_all_columns(
+            [SegmentModel.change_number, SegmentKeyModel.name],
+            SegmentModel.name == segment_name,
+            outer_join=SegmentModel.keys,
+        )
+        if not rows:
+            return None
+        keys = [key for _, key in rows if key is not None]
+        return segments.Segment(segment_name, keys, rows[0][0])
 
     def put(self, segment):
         """
@@ -208,11 +438,18 @@ class SqlSegmentStorage(SegmentStorage):
         :param segment: Segment to store.
         :type segment: splitio.models.segment.Segment
         """
-        record = self._db_client.get_one_or_none(SegmentModel, SegmentModel.name == segment.name)
-        if record is None:
-            record = SegmentModel(name=segment.name, change_number=segment.change_number)
-        record.keys = [SegmentKeyModel(name=key) for key in segment.keys]
-        self._db_client.merge_and_commit(record)
+        keys = set(segment.keys)
+        with self._lock_for(segment.name):
+            # The old filter would rule out the new keys; go to the DB until the new one is in place.
+            self._filters.pop(segment.name, None)
+            with self._db_client.transaction():
+                segment_id, _ = self._get_or_create_segment(segment.name, segment.change_number)
+                self._db_client.update_all(SegmentModel, {'change_number': segment.change_number}, SegmentModel.id == segment_id)
+                self._db_client.delete_all(SegmentKeyModel, SegmentKeyModel.model_id == segment_id)
+                self._insert_keys(segment_id, keys)
+            self._filters[segment.name] = _SegmentFilter(
+                _BloomFilter(keys), segment.change_number, time.monotonic() + self._cache_ttl,
+            )
 
     def update(self, segment_name, to_add, to_remove, change_number=None):
         """
@@ -225,15 +462,21 @@ class SqlSegmentStorage(SegmentStorage):
         :param to_remove: List of members to remove from the segment.
         :type to_remove: Set
         """
-        record = self._db_client.get_one_or_none(SegmentModel, SegmentModel.name == segment_name)
-        if record is None:
-            record = SegmentModel(name=segment_name, change_number=change_number)
-        record.keys = [key for key in record.keys if key.name not in to_remove]
-        for add in to_add:
-            record.keys.append(SegmentKeyModel(name=add))
-        if change_number is not None:
-            record.change_number = change_number
-        self._db_client.merge_and_commit(record)
+        to_add = set(to_add)
+        with self._lock_for(segment_name):
+            segment_filter = self._filters.get(segment_name)
+            if segment_filter is not None:
+                # Added before storing the keys, so the filter never rules out a stored key.
+                segment_filter.keys.update(to_add)
+            with self._db_client.transaction():
+                segment_id, stored_change_number = self._get_or_create_segment(segment_name, change_number)
+                self._delete_keys(segment_id, set(to_remove) - to_add)
+                # Keys the segment already has are skipped.
+                self._db_client.insert_ignore(SegmentKeyModel, [{'model_id': segment_id, 'name': key} for key in to_add])
+                if change_number is not None:
+                    self._db_client.update_all(SegmentModel, {'change_number': change_number}, SegmentModel.id == segment_id)
+            if change_number is not None:
+                self._renew_filter(segment_name, stored_change_number, change_number)
 
     def get_change_number(self, segment_name):
         """
@@ -244,10 +487,8 @@ class SqlSegmentStorage(SegmentStorage):
 
         :rtype: int
         """
-        segment = self.get(segment_name)
-        if segment is None:
-            return None
-        return segment.change_number
+        rows = self._db_client.get_all_columns([SegmentModel.change_number], SegmentModel.name == segment_name)
+        return rows[0][0] if rows else None
 
     def set_change_number(self, segment_name, new_change_number):
         """
@@ -258,10 +499,27 @@ class SqlSegmentStorage(SegmentStorage):
         :param new_change_number: New change number.
         :type new_change_number: int
         """
-        record = self._db_client.get_one_or_none(SegmentModel, SegmentModel.name == segment_name)
-        if record is not None:
-            record.change_number = new_change_number
-            self._db_client.merge_and_commit(record)
+        with self._lock_for(segment_name):
+            stored_change_number = self.get_change_number(segment_name) if segment_name in self._filters else None
+            self._db_client.update_all(SegmentModel, {'change_number': new_change_number}, SegmentModel.name == segment_name)
+            self._renew_filter(segment_name, stored_change_number, new_change_number)
+
+    def _is_current(self, segment_name, segment_filter):
+        """
+        Tell whether a filter still holds every key of its segment. Expired filters are checked against
+        the stored change number, and renewed if it didn't change or dropped otherwise.
+        """
+        if time.monotonic() < segment_filter.expires:
+            return True
+        with self._lock_for(segment_name):
+            if self._filters.get(segment_name) is not segment_filter:
+                # Replaced or dropped meanwhile; the next lookup uses whatever is there now.
+                return False
+            if self.get_change_number(segment_name) != segment_filter.change_number:
+                del self._filters[segment_name]
+                return False
+            self._filters[segment_name] = segment_filter._replace(expires=time.monotonic() + self._cache_ttl)
+            return True
 
     def segment_contains(self, segment_name, key):
         """
@@ -275,29 +533,132 @@ class SqlSegmentStorage(SegmentStorage):
         :return: True if the segment contains the key. False otherwise.
         :rtype: bool
         """
-        return self._db_client.get_one_or_none(
+        segment_filter = self._filters.get(segment_name)
+        if segment_filter is not None and key not in segment_filter.keys and self._is_current(segment_name, segment_filter):
+            return False
+        return self._db_client.exists(
             SegmentKeyModel,
-            SegmentKeyModel.model.has(name=segment_name),
+            self._KEY_SEGMENT_JOIN,
+            SegmentModel.name == segment_name,
             SegmentKeyModel.name == key,
-        ) is not None
+        )
 
 
 class SqlMySegmentsStorage:
-    def __init__(self, db_client):
+    """DB based storage for the segments a traffic key belongs to."""
+
+    def __init__(self, db_client, cache_ttl=5, cache_size=16):
+        """
+        Class constructor.
+
+        :param db_client: DB client or compliant interface.
+        :type db_client: splitio.storage.sql.DbClient
+        :param cache_ttl: How many seconds segment memberships are kept in memory.
+        :type cache_ttl: float
+        :param cache_size: Maximum number of traffic keys to keep memberships for.
+        :type cache_size: int
+        """
         self._db_client = db_client
+        # traffic key -> frozenset of segment names
+        self._membership = TTLCache(maxsize=cache_size, ttl=cache_ttl)
+        self._membership_lock = threading.Lock()
+
+    def _get_membership(self, traffic_key):
+        with self._membership_lock:
+            segment_names = self._membership.get(traffic_key)
+        if segment_names is None:
+            segment_names = frozenset(self.get(traffic_key))
+            with self._membership_lock:
+                self._membership[traffic_key] = segment_names
+        return segment_names
 
     def get(self, traffic_key):
-        return [record.name for record in self._db_client.get_all(MySegmentModel, MySegmentModel.traffic_key == traffic_key)]
+        return [record.segment_name for record in self._db_client.get_all(MySegmentModel, MySegmentModel.traffic_key == traffic_key)]
 
     def put(self, traffic_key, segment_names):
-        self._db_client.delete_all(MySegmentModel, MySegmentModel.traffic_key == traffic_key)
-        self._db_client.merge_and_commit(*[MySegmentModel(traffic_key=traffic_key, segment_name=segment_name) for segment_name in segment_names])
+        segment_names = frozenset(segment_names)
+        with self._db_client.transaction():
+            existing = frozenset(self.get(traffic_key))
+            to_remove = existing - segment_names
+            to_add = segment_names - existing
+            if to_remove:
+                self._db_client.delete_all(
+                    MySegmentModel,
+                    MySegmentModel.traffic_key == traffic_key,
+                    MySegmentModel.segment_name.in_(to_remove),
+                )
+            if to_add:
+                self._db_client.insert_ignore(
+                    MySegmentModel,
+                    [{'traffic_key': traffic_key, 'segment_name': segment_name} for segment_name in to_add],
+                )
+        with self._membership_lock:
+            self._membership[traffic_key] = segment_names
 
     def segment_contains(self, segment_name, key):
-        return self._db_client.get_count(MySegmentModel, MySegmentModel.traffic_key == key, MySegmentModel.segment_name == segment_name) > 0
+        return segment_name in self._get_membership(key)
 
     def clear(self):
         self._db_client.delete_all(MySegmentModel)
+        with self._membership_lock:
+            self._membership.clear()
+
+
+class _Counter:
+    """Thread safe integer counter."""
+
+    def __init__(self, value=0):
+        self._value = value
+        self._lock = threading.Lock()
+
+    def add(self, delta):
+        """
+        Add to the counter.
+
+        :param delta: Amount to add, may be negative.
+        :type delta: int
+
+        :return: The updated value.
+        :rtype: int
+        """
+        with self._lock:
+            self._value += delta
+            return self._value
+
+    def set(self, value):
+        """
+        Reset the counter to a known value.
+
+        :param value: New value.
+        :type value: int
+        """
+        with self._lock:
+            self._value = value
+
+
+def _take_impressions(record, count):
+    """
+    Take the oldest impressions out of a stored batch, for DbClient.pop_front.
+    """
+    batch = serialization.loads(record.json_data)
+    taken, rest = batch[:count], batch[count:]
+    if rest:
+        record.json_data = serialization.dumps(rest)
+        record.item_count = len(rest)
+    return taken, not rest
+
+
+def _take_events(record, count):
+    """
+    Take the oldest [size, event] pairs out of a stored batch, for DbClient.pop_front.
+    """
+    batch = serialization.loads(record.json_data)
+    taken, rest = batch[:count], batch[count:]
+    if rest:
+        record.json_data = serialization.dumps(rest)
+        record.item_count = len(rest)
+        record.size = sum(size for size, _ in rest)
+    return taken, not rest
 
 
 class SqlImpressionStorage(ImpressionStorage):
@@ -314,6 +675,8 @@ class SqlImpressionStorage(ImpressionStorage):
         self._queue_size = queue_size
         self._db_client = db_client
         self._table_full_hook = None
+        (row_count,) = db_client.get_aggregates(func.coalesce(func.sum(ImpressionModel.item_count), 0))
+        self._row_count = _Counter(row_count)
 
     def set_table_full_hook(self, hook):
         """
@@ -331,8 +694,14 @@ class SqlImpressionStorage(ImpressionStorage):
         :param impressions: List of one or more impressions to store.
         :type impressions: list
         """
-        self._db_client.merge_and_commit(*[ImpressionModel(json_data=json.dumps(impression)) for impression in impressions])
-        if self._db_client.get_count(ImpressionModel) > self._queue_size:
+        if not impressions:
+            return True
+        # The whole batch is stored as a single record.
+        self._db_client.bulk_insert(ImpressionModel, [{
+            'json_data': serialization.dumps([tuple(impression) for impression in impressions]),
+            'item_count': len(impressions),
+        }])
+        if self._row_count.add(len(impressions)) > self._queue_size and self._table_full_hook is not None:
             self._table_full_hook()
         return True
 
@@ -343,14 +712,16 @@ class SqlImpressionStorage(ImpressionStorage):
         :param count: Number of impressions to pop.
         :type count: int
         """
-        records = self._db_client.pop(ImpressionModel, count, order_by=ImpressionModel.created_at)
-        return [Impression(*json.loads(record.json_data)) for record in records]
+        impressions = self._db_client.pop_front(ImpressionModel, count, _take_impressions)
+        self._row_count.add(-len(impressions))
+        return list(starmap(Impression, impressions))
 
     def clear(self):
         """
         Clear data.
         """
         self._db_client.delete_all(ImpressionModel)
+        self._row_count.set(0)
 
 
 class SqlEventStorage(EventStorage):
@@ -361,6 +732,9 @@ class SqlEventStorage(EventStorage):
     """
 
     MAX_SIZE_BYTES = 5 * 1024 * 1024
+    # Limits of the events stored together in a single record.
+    MAX_RECORD_EVENTS = 64
+    MAX_RECORD_BYTES = 1024 * 1024
 
     def __init__(self, db_client, queue_size):
         """
@@ -373,6 +747,12 @@ class SqlEventStorage(EventStorage):
         self._queue_size = queue_size
         self._db_client = db_client
         self._table_full_hook = None
+        row_count, size_bytes = db_client.get_aggregates(
+            func.coalesce(func.sum(EventModel.item_count), 0),
+            func.coalesce(func.sum(EventModel.size), 0),
+        )
+        self._row_count = _Counter(row_count)
+        self._size_bytes = _Counter(size_bytes)
 
     def set_table_full_hook(self, hook):
         """
@@ -383,15 +763,40 @@ class SqlEventStorage(EventStorage):
         if callable(hook):
             self._table_full_hook = hook
 
+    def _record_chunks(self, events):
+        """
+        Split events into chunks of at most MAX_RECORD_EVENTS events, or MAX_RECORD_BYTES of event size.
+
+        :rtype: generator
+        """
+        chunk, chunk_size = [], 0
+        for event in events:
+            if chunk and (len(chunk) >= self.MAX_RECORD_EVENTS or chunk_size + event.size > self.MAX_RECORD_BYTES):
+                yield chunk
+                chunk, chunk_size = [], 0
+            chunk.append(event)
+            chunk_size += event.size
+        if chunk:
+            yield chunk
+
     def put(self, events):
         """
         Add an event to storage.
 
         :param event: Event to be added in the storage
         """
-        self._db_client.merge_and_commit(*[EventModel(json_data=json.dumps(event.event), size=event.size) for event in events])
-        if (self._db_client.get_count(EventModel) > self._queue_size
-                or sum(event.size for event in self._db_client.get_all(EventModel)) >= self.MAX_SIZE_BYTES):
+        if not events:
+            return True
+        size = sum(event.size for event in events)
+        # Large batches are split into several records, so that popping part of one doesn't rewrite megabytes.
+        self._db_client.bulk_insert(EventModel, [{
+            'json_data': serialization.dumps([[event.size, tuple(event.event)] for event in chunk]),
+            'item_count': len(chunk),
+            'size': sum(event.size for event in chunk),
+        } for chunk in self._record_chunks(events)])
+        row_count = self._row_count.add(len(events))
+        size_bytes = self._size_bytes.add(size)
+        if (row_count > self._queue_size or size_bytes >= self.MAX_SIZE_BYTES) and self._table_full_hook is not None:
             self._table_full_hook()
         return True
 
@@ -401,27 +806,162 @@ class SqlEventStorage(EventStorage):
 
         :param count: number of items to be retrieved and removed from the queue.
         """
-        records = self._db_client.pop(EventModel, count, order_by=EventModel.created_at)
-        return [Event(*json.loads(record.json_data)) for record in records]
+        events = self._db_client.pop_front(EventModel, count, _take_events)
+        self._row_count.add(-len(events))
+        self._size_bytes.add(-sum(size for size, _ in events))
+        return [Event(*raw) for _, raw in events]
 
     def clear(self):
         """
         Clear data.
         """
         self._db_client.delete_all(EventModel)
+        self._row_count.set(0)
+        self._size_bytes.set(0)
+
+
+def _empty_latency_buckets():
+    return array('Q', bytes(8 * LATENCY_BUCKET_COUNT))
 
 
 class SqlTelemetryStorage(TelemetryStorage):
     """DB implementation of telemetry storage interface."""
 
-    def __init__(self, db_client):
+    def __init__(self, db_client, flush_threshold=1000):
         """
         Construct an instance.
 
         :param db_client: DB client or compliant interface.
         :type db_client: splitio.storage.sql.DbClient
+        :param flush_threshold: How many latencies, counter increments and gauges to accumulate before writing them in the background.
+        :type flush_threshold: int
         """
         self._db_client = db_client
+        self._flush_threshold = flush_threshold
+        # Latencies, counters and gauges are aggregated in memory, and only written in bulk on flush, or by a
+        # background thread once flush_threshold updates are pending. Pops serve the pending aggregates directly,
+        # merged with whatever was already written.
+        self._pending_lock = threading.Lock()
+        self._pending_counters = Counter()
+        self._pending_latencies = defaultdict(_empty_latency_buckets)
+        self._pending_gauges = {}
+        # Pending updates of each kind, which are taken separately by the pops.
+        self._pending_counts = Counter()
+        self._flush_requested = threading.Event()
+        self._flusher = None
+        self._flusher_lock = threading.Lock()
+
+    def _add_pending(self, kind):
+        """
+        Account for a new pending update, and tell whether it's time to flush. Called with the pending lock held.
+
+        :param kind: Kind of metric updated: 'counters', 'latencies' or 'gauges'.
+        :type kind: str
+        :rtype: bool
+        """
+        self._pending_counts[kind] += 1
+        return sum(self._pending_counts.values()) >= self._flush_threshold
+
+    def _request_flush(self):
+        """
+        Wake the background flush, starting its thread if it isn't running (yet, or anymore after a fork).
+        """
+        self._flush_requested.set()
+        with self._flusher_lock:
+            if self._flusher is None or not self._flusher.is_alive():
+                self._flusher = threading.Thread(target=self._flush_when_requested, name='TelemetryFlush', daemon=True)
+                self._flusher.start()
+
+    def _flush_when_requested(self):
+        while True:
+            self._flush_requested.wait()
+            self._flush_requested.clear()
+            try:
+                self.flush()
+            except Exception:  # pylint:disable=broad-except
+                _LOGGER.error('Error flushing telemetry, it is kept in memory until the next flush')
+                _LOGGER.debug('Error: ', exc_info=True)
+
+    def _take_pending(self):
+        """
+        Detach the pending counters, latencies and gauges.
+
+        :rtype: tuple
+        """
+        with self._pending_lock:
+            counters, latencies, gauges = self._pending_counters, self._pending_latencies, self._pending_gauges
+            self._pending_counters = Counter()
+            self._pending_latencies = defaultdict(_empty_latency_buckets)
+            self._pending_gauges = {}
+            self._pending_counts.clear()
+        return counters, latencies, gauges
+
+    def _take_pending_counters(self):
+        with self._pending_lock:
+            counters, self._pending_counters = self._pending_counters, Counter()
+            del self._pending_counts['counters']
+        return counters
+
+    def _take_pending_latencies(self):
+        with self._pending_lock:
+            latencies, self._pending_latencies = self._pending_latencies, defaultdict(_empty_latency_buckets)
+            del self._pending_counts['latencies']
+        return latencies
+
+    def _take_pending_gauges(self):
+        with self._pending_lock:
+            gauges, self._pending_gauges = self._pending_gauges, {}
+            del self._pending_counts['gauges']
+        return gauges
+
+    def _restore_pending(self, counters, latencies, gauges):
+        """
+        Put back pending counters, latencies and gauges that couldn't be written.
+        """
+        with self._pending_lock:
+            self._pending_counters.update(counters)
+            self._pending_counts['counters'] += sum(counters.values())
+            for name, counts in latencies.items():
+                pending = self._pending_latencies[name]
+                for bucket, count in enumerate(counts):
+                    pending[bucket] += count
+                self._pending_counts['latencies'] += sum(counts)
+            for name, value in gauges.items():
+                # Gauges set meanwhile are newer.
+                if name not in self._pending_gauges:
+                    self._pending_gauges[name] = value
+                    self._pending_counts['gauges'] += 1
+
+    def flush(self):
+        """
+        Write the pending counters, latencies and gauges in a single transaction, one statement per metric.
+        If the write fails, they are kept pending.
+        """
+        counters, latencies, gauges = self._take_pending()
+        if not counters and not latencies and not gauges:
+            return
+        try:
+            with self._db_client.transaction():
+                for name, amount in counters.items():
+                    self._db_client.increment_or_create(
+                        CounterModel,
+                        CounterModel.value,
+                        CounterModel.name == name,
+                        amount=amount,
+                        name=name,
+                    )
+                for name, counts in latencies.items():
+                    self._db_client.modify_or_create(
+                        LatencyModel,
+                        lambda record, counts=counts: record.add(counts),
+                        LatencyModel.name == name,
+                        name=name,
+                    )
+                for name, value in gauges.items():
+                    self._db_client.upsert(GaugeModel, ['name'], dict(name=name, value=value))
+        except BaseException:
+            self._restore_pending(counters, latencies, gauges)
+            raise
 
     def inc_latency(self, name, bucket):
         """
@@ -432,13 +972,12 @@ class SqlTelemetryStorage(TelemetryStorage):
         :param value: Value of the latency metric.
         :tyoe value: int
         """
-        if 0 <= bucket <= 21:
-            self._db_client.increment_or_create(
-                LatencyModel,
-                getattr(LatencyModel, f'bucket_{bucket}'),
-                LatencyModel.name == name,
-                name=name
-            )
+        if 0 <= bucket < LATENCY_BUCKET_COUNT:
+            with self._pending_lock:
+                self._pending_latencies[name][bucket] += 1
+                should_flush = self._add_pending('latencies')
+            if should_flush:
+                self._request_flush()
 
     def inc_counter(self, name):
         """
@@ -447,7 +986,11 @@ class SqlTelemetryStorage(TelemetryStorage):
         :param name: Name of the counter metric.
         :type name: str
         """
-        self._db_client.increment_or_create(CounterModel, CounterModel.value, CounterModel.name == name, name=name)
+        with self._pending_lock:
+            self._pending_counters[name] += 1
+            should_flush = self._add_pending('counters')
+        if should_flush:
+            self._request_flush()
 
     def put_gauge(self, name, value):
         """
@@ -458,7 +1001,12 @@ class SqlTelemetryStorage(TelemetryStorage):
         :param value: Value of the gauge metric.
         :type value: int
         """
-        self._db_client.update_or_insert(GaugeModel, dict(name=name), dict(value=value))
+        with self._pending_lock:
+            # Only the last value of a gauge is kept.
+            self._pending_gauges[name] = value
+            should_flush = self._add_pending('gauges')
+        if should_flush:
+            self._request_flush()
 
     def pop_counters(self):
         """
@@ -466,7 +1014,9 @@ class SqlTelemetryStorage(TelemetryStorage):
 
         :rtype: list
         """
-        return {counter.name: counter.value for counter in self._db_client.pop(CounterModel)}
+        counters = self._take_pending_counters()
+        counters.update({counter.name: counter.value for counter in self._db_client.pop(CounterModel)})
+        return dict(counters)
 
     def pop_gauges(self):
         """
@@ -475,7 +1025,9 @@ class SqlTelemetryStorage(TelemetryStorage):
         :rtype: list
 
         """
-        return {gauge.name: gauge.value for gauge in self._db_client.pop(GaugeModel)}
+        gauges = self._take_pending_gauges()
+        # Pending gauges are newer than the written ones.
+        return {**{gauge.name: gauge.value for gauge in self._db_client.pop(GaugeModel)}, **gauges}
 
     def pop_latencies(self):
         """
@@ -483,12 +1035,19 @@ class SqlTelemetryStorage(TelemetryStorage):
 
         :rtype: list
         """
-        return {latency.name: latency.buckets for latency in self._db_client.pop(LatencyModel)}
+        latencies = {name: list(counts) for name, counts in self._take_pending_latencies().items()}
+        for latency in self._db_client.pop(LatencyModel):
+            pending = latencies.get(latency.name)
+            latencies[latency.name] = latency.buckets if pending is None else [
+                total + count for total, count in zip(latency.buckets, pending)
+            ]
+        return latencies
 
     def clear(self):
         """
         Clear data.
         """
+        self._take_pending()
         self._db_client.delete_all(LatencyModel)
         self._db_client.delete_all(CounterModel)
         self._db_client.delete_all(GaugeModel)
@@ -26,3 +26,18 @@ class MySegmentsSynchronizer:
         segment_names = self._api.fetch_segments(self._traffic_key)
         self._segment_storage.put(self._traffic_key, segment_names)
         return True
+
+    def synchronize_segment(self, segment_name, till=None):  # pylint:disable=unused-argument
+        """
+        Update segments after a change notification, bypassing any cached segment list.
+
+        :param segment_name: Name of the segment that changed.
+        :type segment_name: str
+        :param till: ChangeNumber received.
+        :type till: int
+
+        :return: True if no error occurs. False otherwise.
+        :rtype: bool
+        """
+        self._api.cache_clear()
+        return self.synchronize_segments()
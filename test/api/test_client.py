@@ -0,0 +1,93 @@
+import pytest
+import requests
+from requests.adapters import HTTPAdapter
+from splitio.api.client import HttpClientException
+
+from split_client_side.api.client import PooledHttpClient
+
+
+# pylint:disable=no-self-use,protected-access
+
+
+class PooledHttpClientTests:
+    """Pooled HTTP client test cases."""
+
+    def test_session_is_reused(self, mocker):
+        """Test that every request goes through a single session."""
+        session_class = mocker.patch('split_client_side.api.client.requests.Session')
+        session = session_class.return_value
+        session.headers = {}
+        session.request.return_value = mocker.Mock(status_code=200, text='ok')
+        client = PooledHttpClient(sdk_url='https://sdk.example.com/api', events_url='https://events.example.com/api')
+
+        response = client.get('sdk', '/splitChanges', 'some_api_key', query={'since': 1}, extra_headers={'extra': 'header'})
+        assert (response.status_code, response.body) == (200, 'ok')
+        client.post('events', '/events/bulk', 'some_api_key', [{'event': 1}])
+
+        assert session_class.call_count == 1
+        assert session.headers['Connection'] == 'keep-alive'
+        assert session.request.mock_calls == [
+            mocker.call(
+                'GET',
+                'https://sdk.example.com/api/splitChanges',
+                headers={'Content-Type': 'application/json', 'Authorization': 'Bearer some_api_key', 'extra': 'header'},
+                timeout=None,
+                params={'since': 1},
+            ),
+            mocker.call(
+                'POST',
+                'https://events.example.com/api/events/bulk',
+                headers={'Content-Type': 'application/json', 'Authorization': 'Bearer some_api_key'},
+                timeout=None,
+                json=[{'event': 1}],
+                params=None,
+            ),
+        ]
+
+    def test_adapters_are_mounted_per_base_url(self):
+        """Test that each distinct base URL gets a pooled adapter that retries connection errors."""
+        client = PooledHttpClient(
+            sdk_url='https://sdk.example.com/api',
+            events_url='https://events.example.com/api',
+            auth_url='https://sdk.example.com/api',
+            pool_maxsize=8,
+            max_retries=3,
+        )
+        session = client._get_session()
+
+        mounted = {url: adapter for url, adapter in session.adapters.items() if 'example.com' in url}
+        assert set(mounted) == {'https://sdk.example.com/api', 'https://events.example.com/api'}
+        for adapter in mounted.values():
+            assert isinstance(adapter, HTTPAdapter)
+            assert adapter._pool_maxsize == 8
+            assert adapter.max_retries.total == 3
+        assert session.get_adapter('https://sdk.example.com/api/splitChanges') is mounted['https://sdk.example.com/api']
+
+    def test_requests_exceptions_are_wrapped(self, mocker):
+        """Test that exceptions raised by requests surface as HttpClientException."""
+        session_class = mocker.patch('split_client_side.api.client.requests.Session')
+        session_class.return_value.headers = {}
+        session_class.return_value.request.side_effect = requests.ConnectionError('connection refused')
+        client = PooledHttpClient()
+
+        with pytest.raises(HttpClientException) as exc_info:
+            client.get('sdk', '/splitChanges', 'some_api_key')
+        assert isinstance(exc_info.value.__cause__, requests.ConnectionError)
+        with pytest.raises(HttpClientException):
+            client.post('events', '/events/bulk', 'some_api_key', [])
+
+    def test_close(self, mocker):
+        """Test that closing the client closes its session, and a later request opens a new one."""
+        session_class = mocker.patch('split_client_side.api.client.requests.Session')
+        session_class.return_value.headers = {}
+        session_class.return_value.request.return_value = mocker.Mock(status_code=200, text='')
+        client = PooledHttpClient()
+        client.get('sdk', '/splitChanges', 'some_api_key')
+
+        client.close()
+        assert session_class.return_value.close.call_count == 1
+        client.close()
+        assert session_class.return_value.close.call_count == 1
+
+        client.get('sdk', '/splitChanges', 'some_api_key')
+        assert session_class.call_count == 2
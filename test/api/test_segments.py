@@ -0,0 +1,67 @@
+import time
+
+import pytest
+from splitio.api import APIException
+from splitio.api.client import HttpResponse
+from splitio.client.util import SdkMetadata
+
+from split_client_side.api.segments import MySegmentsAPI
+
+
+# pylint:disable=no-self-use
+
+
+class MySegmentsAPITests:
+    """My segments API test cases."""
+
+    def _build_api(self, mocker, cache_ttl=3):
+        http_client = mocker.Mock()
+        http_client.get.return_value = HttpResponse(200, '{"mySegments": [{"name": "segment1"}, {"name": "segment2"}]}')
+        api = MySegmentsAPI(http_client, 'some_api_key', SdkMetadata('1.0', 'some_host', '1.2.3.4'), 'key/1', cache_ttl=cache_ttl)
+        return api, http_client
+
+    def test_fetch_segments(self, mocker):
+        """Test that segments are fetched from the escaped path of the traffic key."""
+        api, http_client = self._build_api(mocker)
+
+        assert api.fetch_segments('key/1') == ['segment1', 'segment2']
+        assert api.fetch_segments('other key') == ['segment1', 'segment2']
+        assert [call.args[1] for call in http_client.get.mock_calls] == ['/mySegments/key%2F1', '/mySegments/other%20key']
+
+    def test_fetch_segments_is_cached(self, mocker):
+        """Test that fetched segments are reused per traffic key until the cache is cleared."""
+        api, http_client = self._build_api(mocker)
+
+        assert api.fetch_segments('key/1') == ['segment1', 'segment2']
+        assert api.fetch_segments('key/1') == ['segment1', 'segment2']
+        assert http_client.get.call_count == 1
+
+        api.fetch_segments('other key')
+        assert http_client.get.call_count == 2
+
+        api.cache_clear()
+        api.fetch_segments('key/1')
+        assert http_client.get.call_count == 3
+
+    def test_fetch_segments_cache_expires(self, mocker):
+        """Test that fetched segments are fetched again once the cache TTL elapses."""
+        api, http_client = self._build_api(mocker, cache_ttl=0.05)
+
+        api.fetch_segments('key/1')
+        api.fetch_segments('key/1')
+        assert http_client.get.call_count == 1
+
+        time.sleep(0.1)
+        api.fetch_segments('key/1')
+        assert http_client.get.call_count == 2
+
+    def test_failed_fetches_are_not_cached(self, mocker):
+        """Test that error responses raise, and are not cached."""
+        api, http_client = self._build_api(mocker)
+        http_client.get.return_value = HttpResponse(500, 'error')
+
+        with pytest.raises(APIException):
+            api.fetch_segments('key/1')
+        with pytest.raises(APIException):
+            api.fetch_segments('key/1')
+        assert http_client.get.call_count == 2
@@ -0,0 +1,41 @@
+import threading
+
+from split_client_side.client.factory import ClientSideFactory
+
+
+# pylint:disable=no-self-use
+
+
+class ClientSideFactoryTests:
+    """Client side factory test cases."""
+
+    def _build_factory(self, mocker, http_client):
+        return ClientSideFactory(
+            'some_api_key', {}, True, mocker.Mock(), mocker.Mock(), None,
+            traffic_key='some_traffic_key', http_client=http_client,
+        )
+
+    def test_destroy_closes_http_client(self, mocker):
+        """Test that destroying the factory closes the pooled HTTP connections."""
+        http_client = mocker.Mock()
+        factory = self._build_factory(mocker, http_client)
+
+        factory.destroy()
+
+        assert factory.destroyed
+        assert http_client.close.call_count == 1
+
+    def test_destroy_closes_http_client_once_tasks_stop(self, mocker):
+        """Test that when waiting for the tasks to stop, connections are closed before the destroyed event is set."""
+        http_client = mocker.Mock()
+        factory = self._build_factory(mocker, http_client)
+        tasks_stopping = threading.Event()
+        factory._sync_manager.stop.side_effect = lambda blocking: tasks_stopping.wait(1)  # pylint:disable=protected-access
+        destroyed_event = threading.Event()
+
+        factory.destroy(destroyed_event)
+        assert http_client.close.call_count == 0
+
+        tasks_stopping.set()
+        assert destroyed_event.wait(1)
+        assert http_client.close.call_count == 1
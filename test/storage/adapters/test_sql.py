@@ -0,0 +1,186 @@
+import json
+import sqlite3
+import threading
+
+import pytest
+import sqlalchemy
+from sqlalchemy.dialects import sqlite
+from sqlalchemy.exc import CompileError
+from sqlalchemy.pool import QueuePool
+from splitio.models.events import Event
+from splitio.models.impressions import Impression
+from splitio.models.splits import Split
+from split_client_side.storage.sql import (
+    SqlSplitStorage, SqlSegmentStorage, SqlMySegmentsStorage, SqlImpressionStorage, SqlEventStorage, SqlTelemetryStorage,
+)
+from split_client_side.storage.adapters.sql import DbClient, CounterModel, ImpressionModel
+
+
+# pylint:disable=no-self-use
+
+
+def _sqlite_compiles_returning():
+    try:
+        sqlalchemy.delete(ImpressionModel).returning(ImpressionModel.id).compile(dialect=sqlite.dialect())
+    except CompileError:
+        return False
+    return True
+
+
+class DbClientTests:
+    """DB client test cases."""
+
+    def test_concurrent_increments(self):
+        """Test that sessions opened from several threads don't interfere with each other."""
+        db_client = DbClient()
+
+        def increment():
+            for _ in range(50):
+                db_client.increment_or_create(CounterModel, CounterModel.value, CounterModel.name == 'counter', name='counter')
+
+        threads = [threading.Thread(target=increment) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert db_client.get_one_or_none(CounterModel, CounterModel.name == 'counter').value == 200
+
+    def test_file_database_concurrent_pops(self, tmp_path):
+        """Test that a file database is pooled, and records popped from several threads are popped once."""
+        db_client = DbClient({'sql.url': f'sqlite:///{tmp_path / "split.sqlite"}'})
+        assert isinstance(db_client._db_engine.pool, QueuePool)  # pylint:disable=protected-access
+        storage = SqlImpressionStorage(db_client, 1000)
+        impressions = [Impression('key%d' % i, 'feature1', 'on', 'l1', 123456, 'b1', 321654) for i in range(200)]
+        for impression in impressions:
+            storage.put([impression])
+        popped = []
+
+        def pop():
+            for _ in range(50):
+                popped.extend(storage.pop_many(3))
+
+        threads = [threading.Thread(target=pop) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert sorted(popped) == sorted(impressions)
+
+    @pytest.mark.skipif(not _sqlite_compiles_returning(), reason='this SQLAlchemy version has no RETURNING for SQLite')
+    def test_pop_with_delete_returning(self, mocker):
+        """Test that popping with a single DELETE ... RETURNING takes the selected records only, in order."""
+        mocker.patch('split_client_side.storage.adapters.sql._supports_delete_returning', return_value=True)
+        db_client = DbClient()
+        pop_returning = mocker.spy(db_client, '_pop_returning')
+        db_client.bulk_insert(ImpressionModel, [{'json_data': b'[]', 'item_count': count} for count in (3, 0, 2, 1, 4)])
+
+        popped = db_client.pop(ImpressionModel, 2, ImpressionModel.item_count > 0, order_by=ImpressionModel.id, direction='desc')
+
+        assert len(pop_returning.mock_calls) == 1
+        assert [record.item_count for record in popped] == [4, 1]
+        assert sorted(record.item_count for record in db_client.get_all(ImpressionModel)) == [0, 2, 3]
+
+    # Tables as created before the schema was versioned.
+    _UNVERSIONED_SCHEMA = '''
+        CREATE TABLE split_splits (id INTEGER PRIMARY KEY, name VARCHAR(120), traffic_type_name VARCHAR(120), json_data TEXT);
+        CREATE INDEX ix_split_splits_traffic_type_name ON split_splits (traffic_type_name);
+        CREATE TABLE split_metadata (name VARCHAR(30) PRIMARY KEY, number INTEGER);
+        CREATE TABLE split_segments (id INTEGER PRIMARY KEY, name VARCHAR(120), change_number INTEGER);
+        CREATE TABLE split_segment_keys (id INTEGER PRIMARY KEY, name TEXT, model_id INTEGER REFERENCES split_segments (id));
+        CREATE TABLE split_my_segments (id INTEGER PRIMARY KEY, traffic_key VARCHAR(120), segment_name VARCHAR(120));
+        CREATE TABLE split_impressions (id INTEGER PRIMARY KEY, status VARCHAR(22), created_at DATETIME, json_data TEXT);
+        CREATE TABLE split_events (id INTEGER PRIMARY KEY, created_at DATETIME, json_data TEXT, size INTEGER);
+        CREATE TABLE split_latencies (id INTEGER PRIMARY KEY, name TEXT, %s);
+        CREATE TABLE split_counters (id INTEGER PRIMARY KEY, name TEXT, value INTEGER);
+        CREATE TABLE split_gauges (id INTEGER PRIMARY KEY, name TEXT, value INTEGER);
+    ''' % ', '.join(f'bucket_{bucket} INTEGER' for bucket in range(22))
+
+    def _create_unversioned_database(self, path, events):
+        split = Split('some_split', 400, False, 'off', 'user', 'ACTIVE', 123)
+        impressions = [Impression(f'key{n}', 'feature1', 'on', 'l1', 123456, 'b1', 321654) for n in range(2)]
+        connection = sqlite3.connect(path)
+        connection.executescript(self._UNVERSIONED_SCHEMA)
+        connection.executemany('INSERT INTO split_splits (name, traffic_type_name, json_data) VALUES (?, ?, ?)', [
+            (split.name, split.traffic_type_name, json.dumps(split.to_json())),
+        ])
+        connection.executemany('INSERT INTO split_metadata VALUES (?, ?)', [('change_number', 123)])
+        connection.executemany('INSERT INTO split_segments VALUES (?, ?, ?)', [(1, 'some_segment', 456)])
+        connection.executemany('INSERT INTO split_segment_keys (name, model_id) VALUES (?, ?)', [('key1', 1), ('key2', 1), ('key1', 1)])
+        connection.executemany('INSERT INTO split_my_segments (traffic_key, segment_name) VALUES (?, ?)', [('key1', 'some_segment')] * 2)
+        connection.executemany('INSERT INTO split_impressions (json_data) VALUES (?)', [(json.dumps(impression),) for impression in impressions])
+        connection.executemany('INSERT INTO split_events (json_data, size) VALUES (?, ?)', events)
+        connection.executemany('INSERT INTO split_latencies (name, bucket_5) VALUES (?, ?)', [('sdk.get_treatment', 2), ('sdk.get_treatment', 1)])
+        connection.executemany('INSERT INTO split_counters (name, value) VALUES (?, ?)', [('some_counter', 2), ('some_counter', 1)])
+        connection.executemany('INSERT INTO split_gauges (name, value) VALUES (?, ?)', [('some_gauge', 1), ('some_gauge', 2)])
+        connection.commit()
+        connection.close()
+        return split, impressions
+
+    def test_unversioned_schema_is_migrated(self, tmp_path):
+        """Test that tables created before the schema was versioned are converted, keeping cached and queued data."""
+        path = tmp_path / 'split.sqlite'
+        event = Event('key1', 'user', 'purchase', 3.5, 123456, None)
+        split, impressions = self._create_unversioned_database(path, [(json.dumps(event), 1024)])
+
+        db_client = DbClient({'sql.url': f'sqlite:///{path}'})
+
+        split_storage = SqlSplitStorage(db_client)
+        assert split_storage.get_change_number() == 123
+        assert split_storage.get('some_split').to_json() == split.to_json()
+        assert split_storage.is_valid_traffic_type('user')
+        segment_storage = SqlSegmentStorage(db_client)
+        assert segment_storage.get('some_segment').keys == {'key1', 'key2'}
+        assert segment_storage.get_change_number('some_segment') == 456
+        assert SqlMySegmentsStorage(db_client).get('key1') == ['some_segment']
+        assert SqlImpressionStorage(db_client, 1000).pop_many(10) == impressions
+        assert SqlEventStorage(db_client, 1000).pop_many(10) == [event]
+        telemetry_storage = SqlTelemetryStorage(db_client)
+        assert telemetry_storage.pop_latencies()['sdk.get_treatment'][5] == 3
+        assert telemetry_storage.pop_counters() == {'some_counter': 3}
+        assert telemetry_storage.pop_gauges() == {'some_gauge': 2}
+
+        # Migrated databases are kept as they are from then on.
+        split_storage.set_change_number(789)
+        assert SqlSplitStorage(DbClient({'sql.url': f'sqlite:///{path}'})).get_change_number() == 789
+
+    def test_failed_migration_is_rolled_back(self, tmp_path):
+        """Test that a migration that fails leaves the tables as they were."""
+        path = tmp_path / 'split.sqlite'
+        self._create_unversioned_database(path, [('not json', 1024)])
+
+        with pytest.raises(ValueError):
+            DbClient({'sql.url': f'sqlite:///{path}'})
+
+        connection = sqlite3.connect(path)
+        assert connection.execute('SELECT COUNT(*) FROM split_impressions').fetchone() == (2,)
+        assert connection.execute('SELECT json_data FROM split_events').fetchall() == [('not json',)]
+        assert connection.execute("SELECT 1 FROM split_metadata WHERE name = 'schema_version'").fetchall() == []
+        connection.close()
+
+    def test_other_schema_version_is_rebuilt(self, tmp_path):
+        """Test that tables created for another schema version are dropped and re-created."""
+        path = tmp_path / 'split.sqlite'
+        connection = sqlite3.connect(path)
+        connection.executescript('''
+            CREATE TABLE split_metadata (name VARCHAR(30) PRIMARY KEY, number INTEGER);
+            INSERT INTO split_metadata VALUES ('change_number', 123), ('schema_version', 999);
+            CREATE TABLE split_impressions (id INTEGER PRIMARY KEY, payload BLOB);
+            INSERT INTO split_impressions (payload) VALUES (x'00');
+        ''')
+        connection.close()
+
+        db_client = DbClient({'sql.url': f'sqlite:///{path}'})
+        impression = Impression('key1', 'feature1', 'on', 'l1', 123456, 'b1', 321654)
+        impression_storage = SqlImpressionStorage(db_client, 1000)
+        impression_storage.put([impression])
+        assert impression_storage.pop_many(10) == [impression]
+        assert SqlSplitStorage(db_client).get_change_number() == 0
+
+    def test_current_schema_is_kept(self, tmp_path):
+        """Test that reopening a database created for the current schema keeps its data."""
+        url = f'sqlite:///{tmp_path / "split.sqlite"}'
+        SqlSplitStorage(DbClient({'sql.url': url})).set_change_number(123)
+
+        assert SqlSplitStorage(DbClient({'sql.url': url})).get_change_number() == 123
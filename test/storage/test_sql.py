@@ -1,9 +1,18 @@
+import threading
+import time
+
+import pytest
+from sqlalchemy import func
 from splitio.models.events import EventWrapper, Event
 from splitio.models.impressions import Impression
 from splitio.models.segments import Segment
+from splitio.models import splits
 from splitio.models.splits import Split
-from split_client_side.storage.sql import SqlSplitStorage, SqlSegmentStorage, SqlImpressionStorage, SqlEventStorage, SqlTelemetryStorage
-from split_client_side.storage.adapters.sql import DbClient
+from split_client_side.storage import sql as sql_storage
+from split_client_side.storage.sql import (
+    SqlSplitStorage, SqlSegmentStorage, SqlMySegmentsStorage, SqlImpressionStorage, SqlEventStorage, SqlTelemetryStorage,
+)
+from split_client_side.storage.adapters.sql import DbClient, CounterModel, EventModel, ImpressionModel, LatencyModel, MySegmentModel
 
 
 # pylint:disable=no-self-use
@@ -50,6 +59,56 @@ class SqlSplitStorageTests:
         assert result is not None
         assert from_raw.mock_calls == [mocker.call(split.to_json())]
 
+    def test_get_split_is_decoded_once_per_change_number(self, mocker):
+        """Test that decoded splits are reused until the split changes."""
+        from_raw = mocker.Mock()
+        mocker.patch('splitio.storage.redis.splits.from_raw', new=from_raw)
+
+        storage = SqlSplitStorage(DbClient())
+        split = self._create_split_model('some_split', change_number=1)
+        storage.put(split)
+        storage.get('some_split')
+        storage.get('some_split')
+
+        assert from_raw.mock_calls == [mocker.call(split.to_json())]
+
+        updated_split = self._create_split_model('some_split', change_number=2)
+        storage.put(updated_split)
+        storage.get('some_split')
+        storage.get('some_split')
+
+        assert from_raw.mock_calls == [mocker.call(split.to_json()), mocker.call(updated_split.to_json())]
+
+    def test_get_split_is_served_from_memory(self, mocker):
+        """Test that looked up splits are reused without a query until they change or expire."""
+        db_client = DbClient()
+        storage = SqlSplitStorage(db_client)
+        storage.put(self._create_split_model('some_split', change_number=1))
+        get_all_columns = mocker.spy(db_client, 'get_all_columns')
+
+        assert storage.get('some_split').change_number == 1
+        assert storage.get('some_split').change_number == 1
+        assert storage.get('missing_split') is None
+        assert storage.get('missing_split') is None
+        assert len(get_all_columns.mock_calls) == 2
+
+        results = storage.fetch_many(['some_split', 'missing_split', 'other_split'])
+        assert results['some_split'].change_number == 1
+        assert results['missing_split'] is None and results['other_split'] is None
+        assert len(get_all_columns.mock_calls) == 3
+
+        storage.put(self._create_split_model('some_split', change_number=2))
+        get_all_columns.reset_mock()
+        assert storage.get('some_split').change_number == 2
+        assert storage.get('some_split').change_number == 2
+        assert len(get_all_columns.mock_calls) == 1
+
+        # Changes written by another storage are seen once the cached lookup expires.
+        expiring_storage = SqlSplitStorage(db_client, cache_ttl=0)
+        assert expiring_storage.get('some_split').change_number == 2
+        SqlSplitStorage(db_client).put(self._create_split_model('some_split', change_number=3))
+        assert expiring_storage.get('some_split').change_number == 3
+
     def test_fetch_many_splits(self):
         storage = SqlSplitStorage(DbClient())
         splits = [self._create_split_model(f'some_split_{n}') for n in range(4)]
@@ -62,6 +121,18 @@ class SqlSplitStorageTests:
         assert results['some_split_2'] is not None
         assert results['some_split_4'] is None
 
+    def test_fetch_many_splits_long_list(self):
+        """Test fetching more splits than fit in a single statement."""
+        storage = SqlSplitStorage(DbClient())
+        storage.put(self._create_split_model('some_split_0'))
+        storage.put(self._create_split_model('some_split_1100'))
+        split_names = [f'some_split_{n}' for n in range(1200)]
+
+        results = storage.fetch_many(split_names)
+
+        assert list(results) == split_names
+        assert {name for name, split in results.items() if split is not None} == {'some_split_0', 'some_split_1100'}
+
     def test_get_split_names(self):
         storage = SqlSplitStorage(DbClient())
         split_names = [f'some_split_{n}' for n in range(4)]
@@ -96,6 +167,92 @@ class SqlSplitStorageTests:
 
         assert set(split_names) - {'some_split_0'} == {s.name for s in all_splits}
 
+    def test_change_number(self):
+        """Test storing and retrieving the split change number."""
+        storage = SqlSplitStorage(DbClient())
+        assert storage.get_change_number() == 0
+
+        storage.set_change_number(123)
+        assert storage.get_change_number() == 123
+
+        storage.set_change_number(456)
+        assert storage.get_change_number() == 456
+
+    def test_put_is_a_single_write(self, mocker):
+        """Test that storing a split doesn't read anything before the upsert."""
+        db_client = DbClient()
+        storage = SqlSplitStorage(db_client)
+        storage.put(self._create_split_model('some_split', traffic_type_name='user'))
+        assert storage.is_valid_traffic_type('user') is True
+        get_all_columns = mocker.spy(db_client, 'get_all_columns')
+        upsert = mocker.spy(db_client, 'upsert')
+
+        storage.put(self._create_split_model('some_split', traffic_type_name='account'))
+
+        assert get_all_columns.mock_calls == []
+        assert len(upsert.mock_calls) == 1
+        assert storage.is_valid_traffic_type('user') is False
+        assert storage.is_valid_traffic_type('account') is True
+        assert storage.remove('some_split') is True
+        assert storage.remove('some_split') is False
+
+    def test_kill_locally(self):
+        """Test killing a split locally."""
+        storage = SqlSplitStorage(DbClient())
+        storage.put(self._create_split_model('some_split', default_treatment='on', change_number=1))
+        split = storage.get('some_split')
+
+        storage.kill_locally('some_split', 'off', 2)
+
+        killed_split = storage.get('some_split')
+        assert killed_split.killed
+        assert killed_split.default_treatment == 'off'
+        assert killed_split.change_number == 2
+        # Splits handed out before the kill are left untouched.
+        assert not split.killed
+
+        storage.kill_locally('nonexistant-split', 'off', 3)
+        assert storage.get('nonexistant-split') is None
+
+    def test_get_segment_names(self):
+        """Test retrieving the segments referenced by stored splits."""
+        def _segment_condition(segment_name):
+            return {
+                'conditionType': 'ROLLOUT',
+                'label': 'in segment ' + segment_name,
+                'partitions': [{'treatment': 'on', 'size': 100}],
+                'matcherGroup': {
+                    'combiner': 'AND',
+                    'matchers': [{
+                        'matcherType': 'IN_SEGMENT',
+                        'negate': False,
+                        'keySelector': {'trafficType': 'user', 'attribute': None},
+                        'userDefinedSegmentMatcherData': {'segmentName': segment_name},
+                    }],
+                },
+            }
+
+        storage = SqlSplitStorage(DbClient())
+        assert storage.get_segment_names() == set()
+
+        for name, segment_names in [('split_1', ['segment_1', 'segment_2']), ('split_2', ['segment_2', 'segment_3']), ('split_3', [])]:
+            storage.put(splits.from_raw({
+                'name': name,
+                'seed': 400,
+                'killed': False,
+                'defaultTreatment': 'off',
+                'trafficTypeName': 'user',
+                'status': 'ACTIVE',
+                'changeNumber': 1,
+                'conditions': [_segment_condition(segment_name) for segment_name in segment_names],
+            }))
+
+        assert storage.get_segment_names() == {'segment_1', 'segment_2', 'segment_3'}
+
+        storage.remove('split_1')
+
+        assert storage.get_segment_names() == {'segment_2', 'segment_3'}
+
     def test_is_valid_traffic_type(self):
         """Test that traffic type validation works."""
         storage = SqlSplitStorage(DbClient())
@@ -135,6 +292,35 @@ class SqlSplitStorageTests:
         assert storage.is_valid_traffic_type('user') is True
         assert storage.is_valid_traffic_type('enterprise') is False
 
+    def test_is_valid_traffic_type_existing_splits(self, mocker):
+        """Test that traffic types of splits already in the DB are known, without querying on every check."""
+        db_client = DbClient()
+        SqlSplitStorage(db_client).put(self._create_split_model('some_split_1', traffic_type_name='user'))
+        storage = SqlSplitStorage(db_client)
+        exists = mocker.spy(db_client, 'exists')
+
+        assert storage.is_valid_traffic_type('user') is True
+        assert storage.is_valid_traffic_type('user') is True
+        assert storage.is_valid_traffic_type('enterprise') is False
+        assert storage.is_valid_traffic_type('enterprise') is False
+        assert len(exists.mock_calls) == 2
+
+        storage.remove('some_split_1')
+
+        assert storage.is_valid_traffic_type('user') is False
+
+    def test_is_valid_traffic_type_shared_database(self, tmp_path):
+        """Test that traffic types of splits written by another storage are seen once cached checks expire."""
+        url = f'sqlite:///{tmp_path / "split.sqlite"}'
+        writer = SqlSplitStorage(DbClient({'sql.url': url}))
+        reader = SqlSplitStorage(DbClient({'sql.url': url}), cache_ttl=0)
+
+        assert reader.is_valid_traffic_type('user') is False
+        writer.put(self._create_split_model('some_split_1', traffic_type_name='user'))
+        assert reader.is_valid_traffic_type('user') is True
+        writer.remove('some_split_1')
+        assert reader.is_valid_traffic_type('user') is False
+
 
 class SqlSegmentStorageTests:
     def _assert_segment_equals(self, segment, result):
@@ -205,6 +391,160 @@ class SqlSegmentStorageTests:
         assert not storage.segment_contains('some_segment', 'key3')
         assert storage.get_change_number('some_segment') == 456
 
+        # Re-adding a key doesn't duplicate it.
+        storage.update('some_segment', ['key1'], [], 789)
+        assert sorted(storage.get('some_segment').keys) == ['key1', 'key4', 'key5']
+        assert storage.get_change_number('some_segment') == 789
+
+    def test_segment_update_many_keys(self):
+        """Test updating a segment with more keys than fit in a single statement."""
+        storage = SqlSegmentStorage(DbClient())
+        keys = [f'key{n}' for n in range(1200)]
+        storage.update('some_segment', keys, [], 1)
+        assert storage.get('some_segment').keys == set(keys)
+
+        storage.update('some_segment', [], keys[:1100], 2)
+        assert storage.get('some_segment').keys == set(keys[1100:])
+
+    def test_segment_update_is_atomic(self, mocker):
+        """Test that a failed segment update leaves the segment as it was."""
+        db_client = DbClient()
+        storage = SqlSegmentStorage(db_client)
+        storage.put(Segment('some_segment', ['key1', 'key2'], 1))
+        mocker.patch.object(db_client, 'insert_ignore', side_effect=RuntimeError)
+
+        with pytest.raises(RuntimeError):
+            storage.update('some_segment', ['key3'], ['key1'], 2)
+
+        assert storage.get('some_segment').keys == {'key1', 'key2'}
+        assert storage.get_change_number('some_segment') == 1
+
+    def test_segment_contains_skips_db_for_missing_keys(self, mocker):
+        """Test that keys ruled out by the in-memory filter are not looked up in the DB."""
+        db_client = DbClient()
+        storage = SqlSegmentStorage(db_client)
+        keys = [f'key{n}' for n in range(200)]
+        storage.put(Segment('some_segment', keys, 1))
+        storage.update('some_segment', ['added_key'], [], 2)
+        exists = mocker.spy(db_client, 'exists')
+
+        assert all(storage.segment_contains('some_segment', key) for key in keys + ['added_key'])
+        assert len(exists.mock_calls) == len(keys) + 1
+
+        exists.reset_mock()
+        misses = [storage.segment_contains('some_segment', f'missing{n}') for n in range(200)]
+        assert not any(misses)
+        assert len(exists.mock_calls) < 20
+
+        # Segments stored by another storage instance are always looked up.
+        other_storage = SqlSegmentStorage(db_client)
+        exists.reset_mock()
+        assert other_storage.segment_contains('some_segment', 'key0')
+        assert not other_storage.segment_contains('some_segment', 'missing0')
+        assert len(exists.mock_calls) == 2
+
+    def test_keys_added_by_another_storage_are_not_filtered_out(self, mocker):
+        """Test that expired filters are checked against the segment's change number before ruling keys out."""
+        db_client = DbClient()
+        storage = SqlSegmentStorage(db_client, cache_ttl=0)
+        storage.put(Segment('some_segment', ['key1'], 1))
+        exists = mocker.spy(db_client, 'exists')
+
+        # The segment didn't change, so the filter is trusted.
+        assert not storage.segment_contains('some_segment', 'missing_key')
+        assert exists.mock_calls == []
+
+        SqlSegmentStorage(db_client).update('some_segment', ['added_key'], [], 2)
+        assert storage.segment_contains('some_segment', 'added_key')
+        assert not storage.segment_contains('some_segment', 'missing_key')
+        assert len(exists.mock_calls) == 2
+
+    def test_update_drops_filter_changed_by_another_storage(self):
+        """Test that an update doesn't carry over a filter that missed keys added by another storage."""
+        db_client = DbClient()
+        storage = SqlSegmentStorage(db_client)
+        storage.put(Segment('some_segment', ['key1'], 1))
+
+        SqlSegmentStorage(db_client).update('some_segment', ['added_key'], [], 2)
+        storage.update('some_segment', ['key2'], [], 3)
+
+        assert storage.segment_contains('some_segment', 'added_key')
+        assert storage.segment_contains('some_segment', 'key2')
+        assert not storage.segment_contains('some_segment', 'missing_key')
+
+    def test_update_during_put_is_not_filtered_out(self, mocker):
+        """Test that keys added while a segment's filter is being rebuilt are not ruled out by the new filter."""
+        storage = SqlSegmentStorage(DbClient())
+        storage.put(Segment('some_segment', ['key1'], 1))
+        update = threading.Thread(target=storage.update, args=('some_segment', ['added_key'], [], 3))
+        bloom_filter = sql_storage._BloomFilter  # pylint:disable=protected-access
+
+        def build_filter(keys):
+            # Give the update a chance to run between storing the keys and installing their filter.
+            update.start()
+            update.join(0.2)
+            return bloom_filter(keys)
+
+        mocker.patch('split_client_side.storage.sql._BloomFilter', new=build_filter)
+        storage.put(Segment('some_segment', ['key1', 'key2'], 2))
+        update.join()
+
+        assert storage.segment_contains('some_segment', 'added_key')
+
+
+class SqlMySegmentsStorageTests:
+    def test_segment_contains(self):
+        """Test using storage to determine which segments a traffic key belongs to."""
+        storage = SqlMySegmentsStorage(DbClient())
+
+        assert not storage.segment_contains('some_segment', 'some_key')
+
+        storage.put('some_key', ['some_segment', 'other_segment'])
+
+        assert set(storage.get('some_key')) == {'some_segment', 'other_segment'}
+        assert storage.segment_contains('some_segment', 'some_key')
+        assert storage.segment_contains('other_segment', 'some_key')
+        assert not storage.segment_contains('some_segment', 'other_key')
+
+        storage.put('some_key', ['other_segment'])
+
+        assert not storage.segment_contains('some_segment', 'some_key')
+        assert storage.segment_contains('other_segment', 'some_key')
+
+        storage.clear()
+
+        assert not storage.segment_contains('other_segment', 'some_key')
+
+    def test_put_keeps_existing_memberships(self):
+        """Test that putting the segments of a traffic key only adds and removes the differences."""
+        db_client = DbClient()
+        storage = SqlMySegmentsStorage(db_client)
+        storage.put('some_key', ['some_segment', 'other_segment'])
+        (existing_id,) = db_client.get_column(MySegmentModel.id, MySegmentModel.segment_name == 'other_segment')
+
+        storage.put('some_key', ['other_segment', 'third_segment'])
+
+        assert set(storage.get('some_key')) == {'other_segment', 'third_segment'}
+        assert db_client.get_column(MySegmentModel.id, MySegmentModel.segment_name == 'other_segment') == [existing_id]
+
+        storage.put('some_key', [])
+
+        assert storage.get('some_key') == []
+
+    def test_put_unchanged_memberships(self, mocker):
+        """Test that putting the same segments again doesn't write anything."""
+        db_client = DbClient()
+        storage = SqlMySegmentsStorage(db_client)
+        storage.put('some_key', ['some_segment', 'other_segment'])
+        delete_all = mocker.spy(db_client, 'delete_all')
+        insert_ignore = mocker.spy(db_client, 'insert_ignore')
+
+        storage.put('some_key', ['other_segment', 'some_segment'])
+
+        assert delete_all.mock_calls == []
+        assert insert_ignore.mock_calls == []
+        assert storage.segment_contains('some_segment', 'some_key')
+
 
 class SqlImpressionStorageTests:
     def test_push_pop_impressions(self):
@@ -244,6 +584,31 @@ class SqlImpressionStorageTests:
             Impression('key3', 'feature1', 'on', 'l1', 123456, 'b1', 321654)
         ]
 
+    def test_pop_across_batches(self, mocker):
+        """Test popping part of a stored batch keeps the rest of it queued."""
+        db_client = DbClient()
+        storage = SqlImpressionStorage(db_client, 100)
+        impressions = [Impression('key%d' % i, 'feature1', 'on', 'l1', 123456, 'b1', 321654) for i in range(5)]
+        storage.put(impressions[:3])
+        storage.put(impressions[3:])
+
+        assert storage.pop_many(2) == impressions[:2]
+        assert db_client.get_count(ImpressionModel) == 2
+        assert storage.pop_many(2) == impressions[2:4]
+        assert db_client.get_count(ImpressionModel) == 1
+
+        # A new storage picks up the queued impressions, not the stored batches.
+        queue_full_hook = mocker.Mock()
+        other_storage = SqlImpressionStorage(db_client, 2)
+        other_storage.set_table_full_hook(queue_full_hook)
+        other_storage.put(impressions[:1])
+        assert queue_full_hook.mock_calls == []
+        other_storage.put(impressions[:1])
+        assert queue_full_hook.mock_calls == [mocker.call()]
+
+        assert storage.pop_many(10) == [impressions[4], impressions[0], impressions[0]]
+        assert not storage.pop_many(1)
+
     def test_queue_full_hook(self, mocker):
         """Test queue_full_hook is executed when the queue is full."""
         storage = SqlImpressionStorage(DbClient(), 100)
@@ -256,6 +621,11 @@ class SqlImpressionStorageTests:
         storage.put(impressions)
         assert queue_full_hook.mock_calls == mocker.call()
 
+    def test_queue_full_without_hook(self):
+        """Test that filling the queue without a hook set doesn't fail."""
+        storage = SqlImpressionStorage(DbClient(), 1)
+        assert storage.put([Impression('key%d' % i, 'feature1', 'on', 'l1', 123456, 'b1', 321654) for i in range(2)])
+
     def test_clear(self):
         """Test clear method."""
         storage = SqlImpressionStorage(DbClient(), 100)
@@ -318,6 +688,31 @@ class SqlEventStorageTests:
         storage.put(events)
         assert queue_full_hook.mock_calls == [mocker.call()]
 
+    def test_pop_across_batches(self):
+        """Test popping part of a stored batch keeps the rest of it, and its size, queued."""
+        db_client = DbClient()
+        storage = SqlEventStorage(db_client, 100)
+        events = [EventWrapper(event=Event('key%d' % i, 'user', 'purchase', 3.5, 123456, None), size=1024 * (i + 1)) for i in range(3)]
+        storage.put(events)
+
+        assert storage.pop_many(1) == [events[0].event]
+        assert db_client.get_aggregates(func.sum(EventModel.size)) == (2048 + 3072,)
+        assert storage.pop_many(5) == [events[1].event, events[2].event]
+        assert db_client.get_count(EventModel) == 0
+
+    def test_put_large_batch(self):
+        """Test that large batches are stored in several bounded records, and popped in order."""
+        db_client = DbClient()
+        storage = SqlEventStorage(db_client, 1000)
+        events = [EventWrapper(event=Event('key%d' % i, 'user', 'purchase', 12.5, 1, None), size=32768) for i in range(160)]
+        storage.put(events)
+        storage.put([EventWrapper(event=Event('key%d' % i, 'user', 'purchase', 12.5, 1, None), size=1) for i in range(100)])
+
+        assert db_client.get_count(EventModel) == (160 * 32768) // SqlEventStorage.MAX_RECORD_BYTES + 2
+        assert storage.pop_many(1000) == [event.event for event in events] + [
+            Event('key%d' % i, 'user', 'purchase', 12.5, 1, None) for i in range(100)
+        ]
+
     def test_queue_full_hook_properties(self, mocker):
         """Test queue_full_hook is executed when the queue is full regarding properties."""
         storage = SqlEventStorage(DbClient(), 200)
@@ -371,6 +766,7 @@ class SqlTelemetryStorageTests:
     def test_gauges(self):
         """Test storing and retrieving gauges."""
         storage = SqlTelemetryStorage(DbClient())
+        storage.put_gauge('some_gauge_1', 123)
         storage.put_gauge('some_gauge_1', 321)
         storage.put_gauge('some_gauge_2', 654)
         gauges = storage.pop_gauges()
@@ -390,3 +786,90 @@ class SqlTelemetryStorageTests:
         assert not storage.pop_counters()
         assert not storage.pop_gauges()
         assert not storage.pop_latencies()
+
+    def test_flush_threshold(self, mocker):
+        """Test that pending increments are written in the background once the flush threshold is reached."""
+        db_client = DbClient()
+        storage = SqlTelemetryStorage(db_client, flush_threshold=3)
+        flush_threads = []
+        flush_now = storage.flush
+
+        def flush():
+            flush_threads.append(threading.current_thread().name)
+            flush_now()
+
+        mocker.patch.object(storage, 'flush', side_effect=flush)
+        storage.inc_counter('some_counter_1')
+        storage.inc_latency('sdk.get_treatment', 5)
+        assert db_client.get_count(CounterModel) == 0
+
+        storage.inc_counter('some_counter_1')
+        deadline = time.monotonic() + 5
+        while not db_client.get_count(CounterModel) and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert db_client.get_one_or_none(CounterModel, CounterModel.name == 'some_counter_1').value == 2
+        assert flush_threads == ['TelemetryFlush']
+
+        storage.inc_latency('sdk.get_treatment', 5)
+        assert storage.pop_counters() == {'some_counter_1': 2}
+        assert storage.pop_latencies()['sdk.get_treatment'][5] == 2
+
+    def test_failed_flush_keeps_pending(self, mocker):
+        """Test that what a failed flush couldn't write is kept for the next one."""
+        db_client = DbClient()
+        storage = SqlTelemetryStorage(db_client)
+        storage.inc_counter('some_counter_1')
+        storage.inc_latency('sdk.get_treatment', 5)
+        storage.put_gauge('some_gauge_1', 123)
+        mocker.patch.object(db_client, 'upsert', side_effect=RuntimeError('some error'))
+
+        with pytest.raises(RuntimeError):
+            storage.flush()
+        assert db_client.get_count(CounterModel) == 0
+
+        storage.inc_counter('some_counter_1')
+        storage.put_gauge('some_gauge_1', 321)
+        mocker.stopall()
+        storage.flush()
+        assert storage.pop_counters() == {'some_counter_1': 2}
+        assert storage.pop_latencies()['sdk.get_treatment'][5] == 1
+        assert storage.pop_gauges() == {'some_gauge_1': 321}
+
+    def test_pop_merges_pending(self, mocker):
+        """Test that pops serve pending aggregates without writing them, merged with the written ones."""
+        db_client = DbClient()
+        storage = SqlTelemetryStorage(db_client)
+        storage.inc_counter('some_counter_1')
+        storage.inc_latency('sdk.get_treatment', 5)
+        storage.put_gauge('some_gauge_1', 123)
+        storage.flush()
+        storage.inc_counter('some_counter_1')
+        storage.inc_counter('some_counter_2')
+        storage.inc_latency('sdk.get_treatment', 5)
+        storage.put_gauge('some_gauge_1', 321)
+
+        increment_or_create = mocker.spy(db_client, 'increment_or_create')
+        modify_or_create = mocker.spy(db_client, 'modify_or_create')
+        upsert = mocker.spy(db_client, 'upsert')
+        assert storage.pop_counters() == {'some_counter_1': 2, 'some_counter_2': 1}
+        assert storage.pop_latencies()['sdk.get_treatment'][5] == 2
+        assert storage.pop_gauges() == {'some_gauge_1': 321}
+        assert increment_or_create.call_count == modify_or_create.call_count == upsert.call_count == 0
+        assert not storage.pop_counters()
+        assert not storage.pop_latencies()
+        assert not storage.pop_gauges()
+
+    def test_pop_discounts_pending(self):
+        """Test that popped updates no longer count towards the flush threshold."""
+        db_client = DbClient()
+        storage = SqlTelemetryStorage(db_client, flush_threshold=3)
+        storage.inc_counter('some_counter_1')
+        storage.inc_counter('some_counter_1')
+        assert storage.pop_counters() == {'some_counter_1': 2}
+
+        storage.inc_latency('sdk.get_treatment', 5)
+        storage.put_gauge('some_gauge_1', 123)
+        assert db_client.get_count(LatencyModel) == 0
+
+        storage.inc_counter('some_counter_1')
+        assert db_client.get_count(LatencyModel) == 1
@@ -0,0 +1,29 @@
+from splitio.api.client import HttpResponse
+from splitio.client.util import SdkMetadata
+
+from split_client_side.api.segments import MySegmentsAPI
+from split_client_side.sync.segment import MySegmentsSynchronizer
+
+
+# pylint:disable=no-self-use
+
+
+class MySegmentsSynchronizerTests:
+    """My segments synchronizer test cases."""
+
+    def test_synchronize_segment_bypasses_cache(self, mocker):
+        """Test that a change notification fetches the segments again, instead of using the cached ones."""
+        http_client = mocker.Mock()
+        http_client.get.return_value = HttpResponse(200, '{"mySegments": [{"name": "segment1"}]}')
+        api = MySegmentsAPI(http_client, 'some_api_key', SdkMetadata('1.0', 'some_host', '1.2.3.4'), 'some_key')
+        storage = mocker.Mock()
+        synchronizer = MySegmentsSynchronizer(api, storage, 'some_key')
+
+        assert synchronizer.synchronize_segments()
+        assert synchronizer.synchronize_segments()
+        assert http_client.get.call_count == 1
+
+        http_client.get.return_value = HttpResponse(200, '{"mySegments": [{"name": "segment1"}, {"name": "segment2"}]}')
+        assert synchronizer.synchronize_segment('segment2', 123)
+        assert http_client.get.call_count == 2
+        assert storage.put.mock_calls[-1] == mocker.call('some_key', ['segment1', 'segment2'])